@@ -1,3 +1,4 @@
+worker_class = "asgi"
 reload = True
 accesslog = "-"
 errorlog = "-"
@@ -1,11 +1,31 @@
+import asyncio
+import json
 import logging
+import math
+import multiprocessing
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from hashlib import sha256
+from pathlib import Path
+from urllib.parse import urlencode
+from weakref import WeakKeyDictionary
 
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import AuthBase
 
 API_URL = "https://rebrickable.com/api/v3"
 API_KEY = os.getenv("REBRICKABLE_API_KEY")
+API_CONCURRENCY = int(os.getenv("REBRICKABLE_API_CONCURRENCY", "4"))
+PAGE_SIZE = 1000
+
+API_CACHE_DIR = os.getenv("REBRICKABLE_CACHE_DIR")
+API_CACHE_TTL = int(os.getenv("REBRICKABLE_CACHE_TTL", "86400"))
+API_CACHE_MAX_SIZE = int(os.getenv("REBRICKABLE_CACHE_MAX_SIZE", str(256 * 2**20)))
 
 
 class ApiAuth(AuthBase):
@@ -14,34 +34,226 @@ class ApiAuth(AuthBase):
         return request
 
 
+class ApiError(OSError):
+    """Error reading data from the external API with the async client."""
+
+
+class RateLimiter:
+    """Space out calls to the external API by at least `interval` seconds.
+
+    The time of the next allowed call is kept in shared memory, so one
+    limiter can be shared by worker processes.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self._next_call = multiprocessing.Value("d", 0.0)
+
+    def wait(self):
+        with self._next_call.get_lock():
+            now = time.monotonic()
+            call_time = max(now, self._next_call.value)
+            self._next_call.value = call_time + self.interval
+        if call_time > now:
+            time.sleep(call_time - now)
+
+
+class ResponseCache:
+    """On-disk cache of API responses, keyed by URL.
+
+    Entries younger than `ttl` seconds are used without calling the API,
+    older ones are revalidated with a conditional request. When the cache
+    grows over `max_size` bytes, least recently stored entries are evicted.
+
+    The directory may be shared by processes storing and evicting entries
+    at the same time, so files can disappear at any moment.
+    """
+    def __init__(self, directory, ttl, max_size):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_size = max_size
+        self._size = None
+        self._lock = threading.Lock()  # of `_size`, stored by several threads
+
+    def _path(self, url):
+        return self.directory / f"{sha256(url.encode()).hexdigest()}.json"
+
+    def get(self, url):
+        try:
+            return json.loads(self._path(url).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self, entry):
+        return time.time() - entry["stored_at"] < self.ttl
+
+    @staticmethod
+    def conditional_headers(entry):
+        headers = {}
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, url, data, etag=None, last_modified=None):
+        """Store `data` of `url`. Errors are logged but not raised, since
+        the data was fetched anyway.
+        """
+        entry = {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "stored_at": time.time(),
+            "data": data,
+        }
+        path = self._path(url)
+        temp_path = path.with_suffix(f".{os.getpid()}-{threading.get_ident()}.tmp")
+        try:
+            content = json.dumps(entry)
+            temp_path.write_text(content)
+            temp_path.replace(path)
+            with self._lock:
+                if self._size is None:
+                    self._size = sum(stat.st_size for stat, _ in self._entries())
+                else:
+                    self._size += len(content)
+                if self._size > self.max_size:
+                    self._evict()
+        except (OSError, TypeError, ValueError) as err:
+            logger.warning(f"{err!r} storing cached response: {url}")
+
+    def _entries(self):
+        """Yield the stats and paths of the stored entries, skipping those
+        removed meanwhile.
+        """
+        for path in self.directory.glob("*.json"):
+            try:
+                yield path.stat(), path
+            except FileNotFoundError:
+                continue
+
+    def _evict(self):
+        paths = sorted(self._entries(), key=lambda item: item[0].st_mtime)
+        self._size = sum(stat.st_size for stat, _ in paths)
+        for stat, path in paths:
+            if self._size <= self.max_size:
+                break
+            logger.debug(f"Evicting cached response: {path.name}")
+            path.unlink(missing_ok=True)
+            self._size -= stat.st_size
+
+
 auth = ApiAuth()
 headers = {"Accept": "application/json"}
+rate_limiter = None
+response_cache = (
+    ResponseCache(API_CACHE_DIR, API_CACHE_TTL, API_CACHE_MAX_SIZE)
+    if API_CACHE_DIR else None
+)
 
 logger = logging.getLogger(__name__)
 
 
-def get_set_info(set_lego_id):
-    data = _get_response(f"{API_URL}/lego/sets/{set_lego_id}/")
+def _set_info(data):
     return {
         "name": data["name"],
         "image_url": data["set_img_url"],
     }
 
 
-def _get_paginated_data(url, session):
-    data = _get_response(url, session)
+def _minifig_entry(item):
+    entry = {
+        "lego_id": item["set_num"],
+        "name": item["set_name"],
+        "image_url": item["set_img_url"],
+        "quantity": item["quantity"],
+    }
+    logger.debug(entry)
+    return entry
+
+
+def _part_entry(item):
+    entry = {
+        "lego_id": item["part"]["part_num"],
+        "name": item["part"]["name"],
+        "color_name": _color_name_or_none(item["color"]["name"]),
+        "image_url": item["part"]["part_img_url"],
+        "quantity": item["quantity"],
+        "is_spare": item["is_spare"],
+    }
+    logger.debug(entry)
+    return entry
+
+
+def get_set_info(set_lego_id):
+    data = _get_response(f"{API_URL}/lego/sets/{set_lego_id}/")
+    return _set_info(data)
+
+
+def _page_url(url, page):
+    return f"{url}?{urlencode({"page": page, "page_size": PAGE_SIZE})}"
+
+
+def _get_paginated_data(url, session, concurrency=API_CONCURRENCY):
+    """Yield results from all pages of `url`.
+
+    The number of pages is worked out from the first page, the remaining
+    pages are then fetched by up to `concurrency` threads. Results are
+    yielded in page order.
+    """
+    data = _get_response(_page_url(url, 1), session)
     yield from data["results"]
 
-    next_page_url = data.get("next")
-    if next_page_url:
-        yield from _get_paginated_data(next_page_url, session)
+    num_pages = math.ceil(data["count"] / PAGE_SIZE)
+    if num_pages <= 1:
+        return
+
+    page_urls = [_page_url(url, page) for page in range(2, num_pages + 1)]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for data in executor.map(partial(_get_response, session=session), page_urls):
+            yield from data["results"]
+
+
+def set_rate_limiter(limiter):
+    """Make all subsequent sync API calls wait for `limiter`."""
+
+    global rate_limiter
+    rate_limiter = limiter
 
 
 def _get_response(url, session=None):
+    cache_entry = response_cache and response_cache.get(url)
+    request_headers = headers
+    if cache_entry:
+        if response_cache.is_fresh(cache_entry):
+            return cache_entry["data"]
+        request_headers = headers | response_cache.conditional_headers(cache_entry)
+
+    if rate_limiter is not None:
+        rate_limiter.wait()
     get_func = session.get if session else requests.get
-    response = get_func(url, auth=auth, headers=headers, timeout=5)
+    response = get_func(url, auth=auth, headers=request_headers, timeout=5)
+    if cache_entry and response.status_code == 304:
+        logger.debug(f"Not modified: {url}")
+        response_cache.store(
+            url,
+            cache_entry["data"],
+            cache_entry["etag"],
+            cache_entry["last_modified"],
+        )
+        return cache_entry["data"]
+
     response.raise_for_status()
-    return response.json()
+    data = response.json()
+    if response_cache:
+        response_cache.store(
+            url,
+            data,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+    return data
 
 
 def _color_name_or_none(color_name):
@@ -50,30 +262,61 @@ def _color_name_or_none(color_name):
     return color_name
 
 
-def get_set_parts(set_lego_id):
-    with requests.Session() as session:
+def _get_session(concurrency):
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_maxsize=concurrency))
+    return session
+
+
+def get_set_parts(set_lego_id, concurrency=API_CONCURRENCY):
+    with _get_session(concurrency) as session:
         for item in _get_paginated_data(
-            f"{API_URL}/lego/sets/{set_lego_id}/minifigs/", session
+            f"{API_URL}/lego/sets/{set_lego_id}/minifigs/", session, concurrency
         ):
-            entry = {
-                "lego_id": item["set_num"],
-                "name": item["set_name"],
-                "image_url": item["set_img_url"],
-                "quantity": item["quantity"],
-            }
-            logger.debug(entry)
-            yield entry
+            yield _minifig_entry(item)
 
         for item in _get_paginated_data(
-            f"{API_URL}/lego/sets/{set_lego_id}/parts/", session
+            f"{API_URL}/lego/sets/{set_lego_id}/parts/", session, concurrency
         ):
-            entry = {
-                "lego_id": item["part"]["part_num"],
-                "name": item["part"]["name"],
-                "color_name": _color_name_or_none(item["color"]["name"]),
-                "image_url": item["part"]["part_img_url"],
-                "quantity": item["quantity"],
-                "is_spare": item["is_spare"],
-            }
-            logger.debug(entry)
-            yield entry
+            yield _part_entry(item)
+
+
+# async client
+
+_async_clients = WeakKeyDictionary()
+
+
+def _async_client():
+    """Return the `httpx.AsyncClient` shared by all calls made in the running
+    event loop, i.e. by all requests served by an ASGI worker process, so
+    that they reuse its connections. See `aclose_async_client`.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = httpx.AsyncClient(
+            headers=headers | {"Authorization": f"key {API_KEY}"},
+            timeout=5,
+        )
+    return client
+
+
+async def aclose_async_client():
+    """Close the client of the running event loop, e.g. at server shutdown."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def aget_set_info(set_lego_id):
+    data = await _aget_response(f"{API_URL}/lego/sets/{set_lego_id}/", _async_client())
+    return _set_info(data)
+
+
+async def _aget_response(url, client):
+    try:
+        response = await client.get(url)
+        response.raise_for_status()
+        return response.json()
+    except (httpx.HTTPError, ValueError) as err:    # ValueError: invalid JSON
+        raise ApiError(err) from err
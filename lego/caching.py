@@ -0,0 +1,100 @@
+"""Versions of cached page fragments.
+
+Fragments of a set or part page are cached under keys that include the
+revision of the whole catalog and the `updated_at` of the object, which is
+touched by every change shown on its page. Bumping a version makes the
+fragments cached under the old one unreachable, so they are never read
+again and expire in time. Versions are stored in the database, so they
+change for all processes at once, when the change commits.
+"""
+from django.db import connection
+from django.db.models import Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import LegoPart, LegoSet, Revision, SetItem
+
+FRAGMENT_TIMEOUT = 24 * 60 * 60
+CATALOG_REVISION = "catalog"
+MODELS = {"set": LegoSet, "part": LegoPart}
+
+BUMP_REVISION = """
+INSERT INTO "lego_revision" ("name", "number", "updated_at")
+VALUES (%s, 1, %s)
+ON CONFLICT ("name") DO UPDATE
+SET "number" = "lego_revision"."number" + 1, "updated_at" = EXCLUDED."updated_at"
+RETURNING "number"
+"""
+
+
+def bump_revision(name):
+    """Increment the `Revision` `name` and return its new number. The row
+    stays locked until the current transaction commits, so revisions commit
+    in the order of their numbers.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(BUMP_REVISION, [name, timezone.now()])
+        return cursor.fetchone()[0]
+
+
+def with_catalog_revision(queryset):
+    """Annotate the sets or parts of `queryset` with the number and time of
+    the current catalog revision, in the same query.
+    """
+    catalog = Revision.objects.filter(name=CATALOG_REVISION)
+    return queryset.annotate(
+        catalog_revision=Coalesce(Subquery(catalog.values("number")), 0),
+        catalog_updated_at=Subquery(catalog.values("updated_at")),
+    )
+
+
+def get_version(obj):
+    """Return the version of the cached fragments of `obj`, a set or part
+    annotated by `with_catalog_revision`.
+    """
+    return f"{obj.catalog_revision}-{obj.updated_at.timestamp()}"
+
+
+def bump_versions(kind, pks):
+    """Bump the versions of objects `pks` of `kind` ("set" or "part") by
+    touching their `updated_at`.
+    """
+    pks = set(pks)
+    if pks:
+        MODELS[kind].objects.filter(pk__in=pks).update(updated_at=timezone.now())
+
+
+def bump_image_versions(image_pks):
+    """Bump the versions of the sets and parts whose pages show one of the
+    images `image_pks`.
+    """
+    image_set_pks = set(
+        LegoSet.objects.filter(image__in=image_pks).values_list("pk", flat=True)
+    )
+    image_part_pks = set(
+        LegoPart.objects.filter(image__in=image_pks).values_list("pk", flat=True)
+    )
+    set_pks = set(image_set_pks)
+    part_pks = set(image_part_pks)
+    set_items = SetItem.objects.filter(
+        Q(set__in=image_set_pks) | Q(part__in=image_part_pks)
+    )
+    for set_pk, part_pk in set_items.values_list("set", "part"):
+        if set_pk in image_set_pks:    # part pages show images of their sets
+            part_pks.add(part_pk)
+        if part_pk in image_part_pks:    # set pages show images of their parts
+            set_pks.add(set_pk)
+    bump_versions("set", set_pks)
+    bump_versions("part", part_pks)
+
+
+def bump_shape_versions(shape_pks):
+    """Bump the versions of the parts of shapes `shape_pks` and of the sets
+    with these parts, whose pages show the names of the shapes.
+    """
+    part_pks = set(
+        LegoPart.objects.filter(shape__in=shape_pks).values_list("pk", flat=True)
+    )
+    set_pks = SetItem.objects.filter(part__in=part_pks).values_list("set", flat=True)
+    bump_versions("part", part_pks)
+    bump_versions("set", set_pks)
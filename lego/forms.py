@@ -1,4 +1,11 @@
+import csv
+import io
+import re
+
 from django import forms
+from django.core.exceptions import ValidationError
+
+from .models import Color
 
 
 class SearchForm(forms.Form):
@@ -23,3 +30,84 @@ class AddSetForm(forms.Form):
         widget=forms.TextInput(attrs={"autofocus": True}),
         label="Lego Set ID",
     )
+
+
+class InventoryForm(forms.Form):
+    color = forms.ModelChoiceField(
+        queryset=Color.objects.order_by("name"),
+        required=False,
+        empty_label="all colors",
+    )
+    sort = forms.ChoiceField(
+        choices=(
+            ("quantity", "most owned"),
+            ("sets", "in most sets"),
+            ("part", "Lego ID"),
+        ),
+        required=False,
+    )
+
+
+class BuildableForm(forms.Form):
+    MAX_PARTS_LIST_SIZE = 1024 * 1024
+
+    color_agnostic = forms.BooleanField(required=False, label="Ignore colors")
+    parts_list = forms.FileField(
+        required=False,
+        label="Parts list",
+        help_text=(
+            "A CSV file with the columns lego_id, color and quantity."
+            " By default, the parts of all sets are used."
+        ),
+    )
+
+    def clean_parts_list(self):
+        """Return the rows of the parts list as `(lego_id, color, quantity)`."""
+        parts_list = self.cleaned_data["parts_list"]
+        if parts_list is None:
+            return None
+        if parts_list.size > self.MAX_PARTS_LIST_SIZE:
+            raise ValidationError("The parts list is too large.")
+        try:
+            text = parts_list.read().decode()
+        except UnicodeDecodeError:
+            raise ValidationError("The parts list must be a UTF-8 text file.")
+
+        rows = []
+        for line_number, row in enumerate(csv.DictReader(io.StringIO(text)), 2):
+            try:
+                rows.append(_parse_parts_list_row(row))
+            except (KeyError, AttributeError, TypeError, ValueError):
+                raise ValidationError(f"Invalid line {line_number} of the parts list.")
+        return rows
+
+
+def _parse_parts_list_row(row):
+    lego_id = row["lego_id"].strip()
+    quantity = int(row["quantity"])
+    if not lego_id or quantity < 1:
+        raise ValueError("Invalid row")
+    return lego_id, row["color"].strip() or None, quantity
+
+
+class CompareForm(forms.Form):
+    MAX_SETS = 10
+
+    sets = forms.CharField(
+        max_length=300,
+        label="Lego Set IDs",
+        help_text="Separated by spaces or commas.",
+    )
+
+    def clean_sets(self):
+        lego_ids = []
+        for lego_id in re.split(r"[\s,]+", self.cleaned_data["sets"]):
+            if not lego_id:
+                continue
+            if "-" not in lego_id:
+                lego_id += "-1"
+            if lego_id not in lego_ids:
+                lego_ids.append(lego_id)
+        if not 2 <= len(lego_ids) <= self.MAX_SETS:
+            raise ValidationError(f"Enter 2 to {self.MAX_SETS} different sets.")
+        return lego_ids
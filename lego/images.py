@@ -1,48 +1,235 @@
+import base64
 import io
 import logging
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from hashlib import sha256
 
 import requests
+from requests.adapters import HTTPAdapter
+from django.core.files.base import ContentFile
 from django.core.files.storage import storages
 from django.tasks import task
-from PIL import Image
+from PIL import Image, features
 
-from .models import LegoPart, LegoSet
+from .caching import bump_image_versions, bump_versions
+from .models import Image as ImageModel, LegoPart, LegoSet, SetItem
 
 DEFAULT_IMAGE_FORMAT = "webp"
 MAX_WIDTH = 384
 MAX_HEIGHT = 384
+MAX_DOWNLOAD_SIZE = 10 * 2**20
+DOWNLOAD_CHUNK_SIZE = 64 * 2**10
+THUMBNAIL_SIZES = (96, 192)
+PLACEHOLDER_SIZE = 16
+AVIF_ENABLED = os.getenv("LEGO_IMAGE_AVIF") in ("1", "true") and features.check("avif")
+RESAMPLING_FILTER = Image.Resampling.LANCZOS
+REDUCING_GAP = 2.0
+DOWNLOAD_CONCURRENCY = 8
+RETRY_BACKOFF = 1.0
+PROCESSING_WORKERS = os.process_cpu_count() or 1
+STORED_FIELDS = ("path", "width", "height", "has_avif", "placeholder")
+SPRITE_SHEETS_ENABLED = os.getenv("LEGO_SPRITE_SHEETS") in ("1", "true")
+SPRITE_CELL_SIZE = 192
+MAX_SPRITE_SHEET_SIDE = 16383    # WebP limit
 
 headers = {"Accept": "image/*"}
 
 logger = logging.getLogger(__name__)
 
 
-def _download_image(url):
-    response = requests.get(url, headers=headers, timeout=5)
-    response.raise_for_status()
-    return Image.open(io.BytesIO(response.content))
+def _download(url, session=None):
+    """Stream the content at `url` into memory, up to `MAX_DOWNLOAD_SIZE`
+    bytes.
+    """
+    get_func = session.get if session else requests.get
+    start = time.perf_counter()
+    with get_func(url, headers=headers, timeout=5, stream=True) as response:
+        response.raise_for_status()
+        if int(response.headers.get("Content-Length", 0)) > MAX_DOWNLOAD_SIZE:
+            raise OSError(f"Image larger than {MAX_DOWNLOAD_SIZE} bytes: {url}")
+
+        content = bytearray()
+        for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+            content += chunk
+            if len(content) > MAX_DOWNLOAD_SIZE:
+                raise OSError(f"Image larger than {MAX_DOWNLOAD_SIZE} bytes: {url}")
+
+    logger.info(
+        f"Downloaded {len(content)} bytes in {time.perf_counter() - start:.3f} s: {url}"
+    )
+    return bytes(content)
 
 
 def _scale_down(img):
+    """Scale `img` down in place to fit in `MAX_WIDTH` x `MAX_HEIGHT`.
+
+    `Image.thumbnail` lets JPEG images be decoded at a reduced size (draft
+    mode) and reduces them further before resampling to the final size.
+    """
     scale_factor = min(MAX_WIDTH / img.width, MAX_HEIGHT / img.height)
     if scale_factor >= 1:
         return img
 
-    scaled_img = img.resize(
-        (round(img.width * scale_factor), round(img.height * scale_factor))
+    img.thumbnail(
+        (MAX_WIDTH, MAX_HEIGHT),
+        resample=RESAMPLING_FILTER,
+        reducing_gap=REDUCING_GAP,
     )
-    scaled_img.format = img.format
-    return scaled_img
+    return img
 
 
-def _save_to_media(image, rel_path):
-    logger.info(f"Saving to media: {rel_path}")
+def _encode(image, image_format=DEFAULT_IMAGE_FORMAT):
     stream = io.BytesIO()
-    image.save(stream, format=DEFAULT_IMAGE_FORMAT)
-    storages["default"].save(rel_path, stream)
+    image.save(stream, format=image_format)
+    return stream.getvalue()
+
+
+def _encode_variants(img):
+    """Encode scaled down `img` and its thumbnails smaller than it, keyed by
+    `(size, image_format)`. Size `None` is `img` itself.
+    """
+    image_formats = (
+        (DEFAULT_IMAGE_FORMAT, "avif") if AVIF_ENABLED else (DEFAULT_IMAGE_FORMAT,)
+    )
+    variants = {}
+    for size in (None, *THUMBNAIL_SIZES):
+        if size is None:
+            variant = img
+        elif size < max(img.size):
+            variant = img.copy()
+            variant.thumbnail((size, size), resample=RESAMPLING_FILTER)
+        else:
+            continue
+        for image_format in image_formats:
+            variants[size, image_format] = _encode(variant, image_format)
+    return variants
+
+
+def _save_to_media(content, rel_path):
+    """Save encoded image `content` unless a file at `rel_path` exists.
+    Return the path of the stored file.
+    """
+    storage = storages["default"]
+    if storage.exists(rel_path):
+        logger.info(f"Already in media: {rel_path}")
+        return rel_path
+    logger.info(f"Saving to media: {rel_path} ({len(content)} bytes)")
+    return storage.save(rel_path, ContentFile(content))
+
+
+def _placeholder(img):
+    """Return a tiny version of `img` as a data URI, to show inline until
+    the image is loaded.
+    """
+    placeholder = img.copy()
+    placeholder.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    content = base64.b64encode(_encode(placeholder)).decode()
+    return f"data:image/{DEFAULT_IMAGE_FORMAT};base64,{content}"
+
+
+def _process_image(content):
+    """Open, scale down and encode downloaded image `content`. Return the
+    size of the scaled down image, its placeholder and its encoded variants,
+    or `None` if the content can't be processed, so that the other images
+    of the batch are still stored.
+
+    Run in worker processes by `_store_contents`.
+    """
+    try:
+        img = _scale_down(Image.open(io.BytesIO(content)))
+        return img.size, _placeholder(img), _encode_variants(img)
+    except (OSError, ValueError, Image.DecompressionBombError) as err:
+        # e.g. PIL.UnidentifiedImageError, or a mode that can't be encoded
+        logger.error(f"{err!r} processing image")
+        return None
+
+
+def _content_path(content_hash):
+    return f"lego/img/{content_hash[:2]}/{content_hash}.{DEFAULT_IMAGE_FORMAT}"
+
+
+def variant_path(path, size=None, image_format=DEFAULT_IMAGE_FORMAT):
+    """Return the path of the variant of the image stored at `path` that
+    fits in `size` x `size`, in `image_format`.
+    """
+    stem = path.rsplit(".", 1)[0]
+    suffix = f"-{size}" if size else ""
+    return f"{stem}{suffix}.{image_format}"
+
+
+def _store_contents(contents, reuse_stored=True):
+    """Store downloaded image `contents`, a mapping of `Image` rows to bytes.
+
+    Files are keyed by the SHA-256 hash of the downloaded bytes, so images
+    with identical content share one file, which is processed only once.
+    More than one new image is scaled and encoded by a process pool. Unless
+    `reuse_stored` is false, content already stored is not processed again.
+    Return the stored images.
+    """
+    hashes = {
+        image: sha256(content).hexdigest() for image, content in contents.items()
+    }
+    stored = {
+        image.content_hash: image
+        for image in ImageModel.objects.filter(
+            content_hash__in=set(hashes.values()) if reuse_stored else [],
+            path__isnull=False,
+        )
+    }
+
+    new_contents = {}
+    for image, content_hash in hashes.items():
+        if content_hash in stored:
+            logger.info(f"Same content already stored: {image!r}")
+        else:
+            new_contents.setdefault(content_hash, contents[image])
+
+    if len(new_contents) > 1:
+        with ProcessPoolExecutor(
+            max_workers=min(PROCESSING_WORKERS, len(new_contents)),
+            mp_context=multiprocessing.get_context("fork"),
+        ) as executor:
+            encoded = executor.map(_process_image, new_contents.values())
+    else:
+        encoded = map(_process_image, new_contents.values())
+
+    for content_hash, processed in zip(list(new_contents), encoded):
+        if processed is None:
+            continue
+        (width, height), placeholder, variants = processed
+        rel_path = _content_path(content_hash)
+        for (size, image_format), content in variants.items():
+            _save_to_media(content, variant_path(rel_path, size, image_format))
+        stored[content_hash] = ImageModel(
+            path=rel_path,
+            width=width,
+            height=height,
+            has_avif=(None, "avif") in variants,
+            placeholder=placeholder,
+        )
+
+    stored_images = []
+    for image, content_hash in hashes.items():
+        if content_hash not in stored:
+            logger.error(f"Error processing image: {image!r}")
+            continue
+        for field in STORED_FIELDS:
+            setattr(image, field, getattr(stored[content_hash], field))
+        image.content_hash = content_hash
+        stored_images.append(image)
+
+    ImageModel.objects.bulk_update(stored_images, [*STORED_FIELDS, "content_hash"])
+    if stored_images:
+        bump_image_versions([image.pk for image in stored_images])
+    return stored_images
 
 
-def _store_image(model, pk, subdir):
+def _store_image(model, pk):
     obj = model.objects.get(pk=pk)
     obj_image = obj.image
     if obj_image is None:
@@ -51,26 +238,160 @@ def _store_image(model, pk, subdir):
     if obj_image.origin_url is None:
         logger.info(f"No image URL: {obj_image!r}")
         return
+    if obj_image.path is not None:
+        logger.info(f"Already stored: {obj_image!r}")
+        return
 
     try:
-        image = _download_image(obj_image.origin_url)
-    except OSError as err:    # e.g. requests.HTTPError, PIL.UnidentifiedImageError
+        content = _download(obj_image.origin_url)
+    except OSError as err:    # e.g. requests.HTTPError
         logger.error(f"{err!r} reading image URL for {obj!r}")
         return
-    else:
-        image = _scale_down(image)
 
-    rel_path = f"lego/img/{subdir}/{pk}.{DEFAULT_IMAGE_FORMAT}"
-    _save_to_media(image, rel_path)
-    obj_image.path = rel_path
-    obj_image.save()
+    _store_contents({obj_image: content})
+
+
+def _store_images(model, pks):
+    """Store images of many objects at once. Each image not stored yet is
+    downloaded once, over a shared session by a thread pool.
+    """
+    images = {}
+    for obj in model.objects.select_related("image").filter(pk__in=pks):
+        if obj.image is None or obj.image.origin_url is None:
+            logger.info(f"No image URL: {obj!r}")
+        elif obj.image.path is None:
+            images[obj.image.pk] = obj.image
+    download_and_store(list(images.values()))
+
+
+def download_and_store(images, retries=0, reuse_stored=True):
+    """Download and store the given `Image` rows, over a shared session by
+    a thread pool. Transient download errors are retried `retries` times
+    with exponential backoff. Return the stored images.
+
+    With `reuse_stored` false, the files of content already stored are
+    written again, e.g. to restore missing files shared by other images.
+    """
+    if not images:
+        return []
+    with (
+        requests.Session() as session,
+        ThreadPoolExecutor(max_workers=DOWNLOAD_CONCURRENCY) as executor,
+    ):
+        session.mount("https://", HTTPAdapter(pool_maxsize=DOWNLOAD_CONCURRENCY))
+        downloads = list(
+            executor.map(
+                partial(_try_download, session=session, retries=retries),
+                [image.origin_url for image in images],
+            )
+        )
+
+    return _store_contents(
+        {
+            image: content
+            for image, content in zip(images, downloads)
+            if content is not None
+        },
+        reuse_stored,
+    )
+
+
+def _sprite_source(image):
+    if image.width and max(image.width, image.height) > SPRITE_CELL_SIZE:
+        return variant_path(image.path, SPRITE_CELL_SIZE)
+    return image.path
+
+
+def _build_sprite_sheet(set_pk):
+    """Pack the stored images of the parts of set `set_pk` into one sprite
+    sheet, and save its path and the `[x, y, width, height]` of each part in
+    it, keyed by part pk.
+    """
+    set_ = LegoSet.objects.get(pk=set_pk)
+    parts = list(
+        LegoPart.objects
+        .filter(setitem__set=set_, image__path__isnull=False)
+        .select_related("image")
+        .order_by("pk")
+        .distinct()
+    )
+    columns = math.ceil(math.sqrt(len(parts)))
+    if not parts or columns * SPRITE_CELL_SIZE > MAX_SPRITE_SHEET_SIDE:
+        logger.info(f"No sprite sheet for {len(parts)} part images: {set_!r}")
+        return
+
+    storage = storages["default"]
+    rows = math.ceil(len(parts) / columns)
+    sheet = Image.new("RGBA", (columns * SPRITE_CELL_SIZE, rows * SPRITE_CELL_SIZE))
+    offsets = {}
+    for index, part in enumerate(parts):
+        x = index % columns * SPRITE_CELL_SIZE
+        y = index // columns * SPRITE_CELL_SIZE
+        try:
+            with (
+                storage.open(_sprite_source(part.image)) as file,
+                Image.open(file) as img,
+            ):
+                img.thumbnail(
+                    (SPRITE_CELL_SIZE, SPRITE_CELL_SIZE), resample=RESAMPLING_FILTER
+                )
+                sheet.paste(img.convert("RGBA"), (x, y))
+        except OSError as err:
+            logger.error(f"{err!r} reading stored image for {part!r}")
+            continue
+        offsets[str(part.pk)] = [x, y, img.width, img.height]
+
+    content = _encode(sheet)
+    content_hash = sha256(content).hexdigest()[:16]
+    rel_path = f"lego/img/sprites/{set_.pk}-{content_hash}.{DEFAULT_IMAGE_FORMAT}"
+    rel_path = _save_to_media(content, rel_path)
+    LegoSet.objects.filter(pk=set_.pk).update(
+        sprite_path=rel_path, sprite_offsets=offsets
+    )
+    bump_versions("set", [set_.pk])
+    if set_.sprite_path and set_.sprite_path != rel_path:
+        storage.delete(set_.sprite_path)
+
+
+def _is_transient(err):
+    if isinstance(err, requests.HTTPError) and err.response is not None:
+        status_code = err.response.status_code
+        return status_code == 429 or status_code >= 500
+    return isinstance(err, (requests.ConnectionError, requests.Timeout))
+
+
+def _try_download(url, session, retries=0):
+    for attempt in range(retries + 1):
+        try:
+            return _download(url, session)
+        except OSError as err:    # e.g. requests.HTTPError
+            if attempt == retries or not _is_transient(err):
+                logger.error(f"{err!r} reading image URL {url}")
+                return None
+            delay = RETRY_BACKOFF * 2**attempt
+            logger.warning(f"{err!r} reading image URL {url}, retry in {delay} s")
+            time.sleep(delay)
 
 
 @task
 def store_set_image(pk):
-    _store_image(LegoSet, pk, "sets")
+    _store_image(LegoSet, pk)
 
 
 @task
 def store_part_image(pk):
-    _store_image(LegoPart, pk, "parts")
+    _store_image(LegoPart, pk)
+
+
+@task
+def store_part_images(pks):
+    _store_images(LegoPart, pks)
+    if SPRITE_SHEETS_ENABLED:
+        set_pks = SetItem.objects.filter(part__in=pks).values_list("set", flat=True)
+        for set_pk in set_pks.distinct():
+            build_sprite_sheet.enqueue(set_pk=set_pk)
+
+
+@task
+def build_sprite_sheet(set_pk):
+    _build_sprite_sheet(set_pk)
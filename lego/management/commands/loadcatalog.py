@@ -0,0 +1,279 @@
+import csv
+import gzip
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+
+from lego.caching import CATALOG_REVISION, bump_revision
+from lego.models import LegoSet
+from lego.orm_utils import (
+    rebuild_set_aggregates,
+    refresh_inventory,
+    stamp_items_revision,
+)
+
+NO_COLOR = "[No Color/Any Color]"
+
+# staging table -> (CSV dump, {column: (CSV field, SQL type)})
+STAGING_TABLES = {
+    "stage_color": ("colors", {
+        "id": ("id", "integer"),
+        "name": ("name", "text"),
+    }),
+    "stage_part": ("parts", {
+        "part_num": ("part_num", "text"),
+        "name": ("name", "text"),
+    }),
+    "stage_minifig": ("minifigs", {
+        "fig_num": ("fig_num", "text"),
+        "name": ("name", "text"),
+        "img_url": ("img_url", "text"),
+    }),
+    "stage_set": ("sets", {
+        "set_num": ("set_num", "text"),
+        "name": ("name", "text"),
+        "img_url": ("img_url", "text"),
+    }),
+    "stage_inventory": ("inventories", {
+        "id": ("id", "integer"),
+        "version": ("version", "integer"),
+        "set_num": ("set_num", "text"),
+    }),
+    "stage_inventory_part": ("inventory_parts", {
+        "inventory_id": ("inventory_id", "integer"),
+        "part_num": ("part_num", "text"),
+        "color_id": ("color_id", "integer"),
+        "quantity": ("quantity", "integer"),
+        "is_spare": ("is_spare", "boolean"),
+        "img_url": ("img_url", "text"),
+    }),
+    "stage_inventory_minifig": ("inventory_minifigs", {
+        "inventory_id": ("inventory_id", "integer"),
+        "fig_num": ("fig_num", "text"),
+        "quantity": ("quantity", "integer"),
+    }),
+}
+
+# inventory entries of all sets, in the shape of `api_calls.get_set_parts`
+# entries; only the latest inventory version of each set is used
+STAGE_ITEMS = f"""
+CREATE TEMP TABLE "stage_item" ON COMMIT DROP AS
+WITH "set_inventory" AS (
+  SELECT DISTINCT ON ("set_num") "id", "set_num"
+  FROM "stage_inventory"
+  WHERE "set_num" IN (SELECT "set_num" FROM "stage_set")
+  ORDER BY "set_num", "version" DESC
+)
+SELECT "set_inventory"."set_num", "stage_inventory_part"."part_num" AS "lego_id",
+  NULLIF("stage_color"."name", '{NO_COLOR}') AS "color_name",
+  "stage_inventory_part"."img_url", "stage_inventory_part"."quantity"
+FROM "stage_inventory_part"
+JOIN "set_inventory" ON "set_inventory"."id" = "stage_inventory_part"."inventory_id"
+JOIN "stage_color" ON "stage_color"."id" = "stage_inventory_part"."color_id"
+WHERE NOT "stage_inventory_part"."is_spare"
+UNION ALL
+SELECT "set_inventory"."set_num", "stage_inventory_minifig"."fig_num",
+  NULL, "stage_minifig"."img_url", "stage_inventory_minifig"."quantity"
+FROM "stage_inventory_minifig"
+JOIN "set_inventory" ON "set_inventory"."id" = "stage_inventory_minifig"."inventory_id"
+JOIN "stage_minifig" ON "stage_minifig"."fig_num" = "stage_inventory_minifig"."fig_num";
+"""
+
+MERGE_COLORS = f"""
+INSERT INTO "lego_color" ("name")
+SELECT DISTINCT "name" FROM "stage_color" WHERE "name" <> '{NO_COLOR}'
+ON CONFLICT ("name") DO NOTHING;
+"""
+
+MERGE_SHAPES = """
+INSERT INTO "lego_shape" ("lego_id", "name")
+SELECT DISTINCT ON ("lego_id") "lego_id", "name"
+FROM (
+  SELECT "part_num" AS "lego_id", "name" FROM "stage_part"
+  UNION ALL
+  SELECT "fig_num", "name" FROM "stage_minifig"
+) AS "shape"
+ORDER BY "lego_id"
+ON CONFLICT ("lego_id") DO UPDATE SET "name" = EXCLUDED."name"
+WHERE "lego_shape"."name" <> EXCLUDED."name";
+"""
+
+MERGE_IMAGES = """
+INSERT INTO "lego_image" ("origin_url")
+SELECT "img_url" FROM "stage_item" WHERE "img_url" IS NOT NULL
+UNION
+SELECT "img_url" FROM "stage_set" WHERE "img_url" IS NOT NULL
+ON CONFLICT ("origin_url") DO NOTHING;
+"""
+
+MERGE_PARTS = """
+INSERT INTO "lego_legopart" ("shape_id", "color_id", "image_id")
+SELECT DISTINCT ON ("lego_shape"."id", "lego_color"."id")
+  "lego_shape"."id", "lego_color"."id", "lego_image"."id"
+FROM "stage_item"
+JOIN "lego_shape" ON "lego_shape"."lego_id" = "stage_item"."lego_id"
+LEFT JOIN "lego_color" ON "lego_color"."name" = "stage_item"."color_name"
+LEFT JOIN "lego_image" ON "lego_image"."origin_url" = "stage_item"."img_url"
+ORDER BY "lego_shape"."id", "lego_color"."id", "lego_image"."id"
+ON CONFLICT ("shape_id", "color_id") DO UPDATE
+SET "image_id" = EXCLUDED."image_id", "updated_at" = CLOCK_TIMESTAMP()
+WHERE EXCLUDED."image_id" IS NOT NULL
+  AND "lego_legopart"."image_id" IS DISTINCT FROM EXCLUDED."image_id";
+"""
+
+MERGE_SETS = """
+INSERT INTO "lego_legoset" ("lego_id", "name", "image_id")
+SELECT "stage_set"."set_num", "stage_set"."name", "lego_image"."id"
+FROM "stage_set"
+LEFT JOIN "lego_image" ON "lego_image"."origin_url" = "stage_set"."img_url"
+ON CONFLICT ("lego_id") DO UPDATE
+SET "name" = EXCLUDED."name",
+  "image_id" = COALESCE(EXCLUDED."image_id", "lego_legoset"."image_id"),
+  "updated_at" = CLOCK_TIMESTAMP()
+WHERE "lego_legoset"."name" <> EXCLUDED."name"
+  OR "lego_legoset"."image_id" IS DISTINCT FROM COALESCE(EXCLUDED."image_id", "lego_legoset"."image_id");
+"""
+
+STAGE_SET_ITEMS = """
+CREATE TEMP TABLE "stage_set_item" ON COMMIT DROP AS
+SELECT "lego_legoset"."id" AS "set_id", "lego_legopart"."id" AS "part_id",
+  LEAST(SUM("stage_item"."quantity"), 32767) AS "quantity"
+FROM "stage_item"
+JOIN "lego_legoset" ON "lego_legoset"."lego_id" = "stage_item"."set_num"
+JOIN "lego_shape" ON "lego_shape"."lego_id" = "stage_item"."lego_id"
+LEFT JOIN "lego_color" ON "lego_color"."name" = "stage_item"."color_name"
+JOIN "lego_legopart" ON "lego_legopart"."shape_id" = "lego_shape"."id"
+  AND "lego_legopart"."color_id" IS NOT DISTINCT FROM "lego_color"."id"
+GROUP BY "lego_legoset"."id", "lego_legopart"."id";
+"""
+
+UPDATE_SET_ITEMS = """
+UPDATE "lego_setitem"
+SET "quantity" = "stage_set_item"."quantity"
+FROM "stage_set_item"
+WHERE "lego_setitem"."set_id" = "stage_set_item"."set_id"
+  AND "lego_setitem"."part_id" = "stage_set_item"."part_id"
+  AND "lego_setitem"."quantity" <> "stage_set_item"."quantity";
+"""
+
+DELETE_SET_ITEMS = """
+DELETE FROM "lego_setitem"
+WHERE "set_id" IN (
+  SELECT "lego_legoset"."id"
+  FROM "lego_legoset"
+  JOIN "stage_item" ON "stage_item"."set_num" = "lego_legoset"."lego_id"
+)
+AND NOT EXISTS (
+  SELECT 1 FROM "stage_set_item"
+  WHERE "stage_set_item"."set_id" = "lego_setitem"."set_id"
+    AND "stage_set_item"."part_id" = "lego_setitem"."part_id"
+);
+"""
+
+INSERT_SET_ITEMS = """
+INSERT INTO "lego_setitem" ("set_id", "part_id", "quantity")
+SELECT "set_id", "part_id", "quantity"
+FROM "stage_set_item"
+WHERE NOT EXISTS (
+  SELECT 1 FROM "lego_setitem"
+  WHERE "lego_setitem"."set_id" = "stage_set_item"."set_id"
+    AND "lego_setitem"."part_id" = "stage_set_item"."part_id"
+);
+"""
+
+STAGED_SET_IDS = 'SELECT "set_num" FROM "stage_item"'
+
+MERGE_CATALOG = {
+    "colors": MERGE_COLORS,
+    "shapes": MERGE_SHAPES,
+    "images": MERGE_IMAGES,
+    "parts": MERGE_PARTS,
+    "sets": MERGE_SETS,
+}
+
+MERGE_SET_ITEMS = {
+    "updated set items": UPDATE_SET_ITEMS,
+    "deleted set items": DELETE_SET_ITEMS,
+    "created set items": INSERT_SET_ITEMS,
+}
+
+
+def _read_dump(path, fields):
+    """Yield rows of the gzipped CSV dump at `path`, limited to `fields`.
+    Empty values are read as NULL.
+    """
+    with gzip.open(path, "rt", encoding="utf-8", newline="") as file:
+        for row in csv.DictReader(file):
+            yield [row[field] or None for field in fields]
+
+
+class Command(BaseCommand):
+    help = (
+        "Load the whole catalog from Rebrickable CSV dumps (colors, parts,"
+        " minifigs, sets, inventories, inventory_parts, inventory_minifigs),"
+        " gzipped as downloaded, into staging tables and merge them into the"
+        " database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "directory", type=Path, help="Directory with the *.csv.gz dumps."
+        )
+
+    def handle(self, directory, **options):
+        paths = {
+            dump: directory / f"{dump}.csv.gz"
+            for dump, _ in STAGING_TABLES.values()
+        }
+        missing = [str(path) for path in paths.values() if not path.is_file()]
+        if missing:
+            raise CommandError(f"Missing dumps: {", ".join(missing)}")
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            for table, (dump, columns) in STAGING_TABLES.items():
+                self._copy_dump(cursor, table, paths[dump], columns)
+
+            cursor.execute(STAGE_ITEMS)
+            self._merge(cursor, MERGE_CATALOG)
+
+            cursor.execute(STAGE_SET_ITEMS)
+            cursor.execute('CREATE INDEX ON "stage_set_item" ("set_id", "part_id")')
+            num_changed_items = self._merge(cursor, MERGE_SET_ITEMS)
+            self.stdout.write(f"Merged set aggregates: {rebuild_set_aggregates()}")
+            if num_changed_items:    # after the update of all sets above
+                staged_sets = LegoSet.objects.filter(
+                    lego_id__in=RawSQL(STAGED_SET_IDS, ())
+                )
+                stamp_items_revision(staged_sets)
+
+            # drop staging tables right away, the transaction may be nested
+            staging_tables = [*STAGING_TABLES, "stage_item", "stage_set_item"]
+            cursor.execute(
+                f"DROP TABLE {", ".join(f'"{table}"' for table in staging_tables)}"
+            )
+            bump_revision(CATALOG_REVISION)
+        refresh_inventory.enqueue()
+
+    def _copy_dump(self, cursor, table, path, columns):
+        column_defs = ", ".join(f'"{name}" {type_}' for name, (_, type_) in columns.items())
+        cursor.execute(f'CREATE TEMP TABLE "{table}" ({column_defs}) ON COMMIT DROP')
+
+        column_names = ", ".join(f'"{name}"' for name in columns)
+        fields = [field for field, _ in columns.values()]
+        num_rows = 0
+        with cursor.copy(f'COPY "{table}" ({column_names}) FROM STDIN') as copy:
+            for row in _read_dump(path, fields):
+                copy.write_row(row)
+                num_rows += 1
+        self.stdout.write(f"Copied {path.name}: {num_rows} rows")
+
+    def _merge(self, cursor, steps):
+        """Run the merge `steps`. Return the total number of merged rows."""
+        num_rows = 0
+        for step, sql in steps.items():
+            cursor.execute(sql)
+            self.stdout.write(f"Merged {step}: {cursor.rowcount}")
+            num_rows += cursor.rowcount
+        return num_rows
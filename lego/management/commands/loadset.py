@@ -1,26 +1,118 @@
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 from django.core.management.base import LabelCommand
+from django.db import connections
+
+from lego.api_calls import RateLimiter, get_set_info, set_rate_limiter
+from lego.orm_utils import (
+    add_to_collection,
+    get_set,
+    refresh_inventory,
+    save_set_with_parts,
+)
+
+
+def _load_set(lego_id):
+    """Add or update the set with the given `lego_id`. Return report lines
+    and the numbers of created, updated and deleted set items.
+    """
+    lines = []
+    set_info = get_set_info(lego_id)
 
-from lego.api_calls import get_set_info
-from lego.orm_utils import get_set, save_set_with_parts
+    set_, created = get_set(lego_id)
+    if not created:
+        lines.append(f"Updating existing set:\n{set_!r}")
+        if set_.name != set_info["name"]:
+            lines.append(f"Set name changed: {set_info["name"]}")
+        if set_.image.origin_url != set_info["image_url"]:
+            lines.append(f"Set image URL changed: {set_info["image_url"]}")
+    if add_to_collection(set_) and not created:
+        lines.append("Set added to the collection")
+
+    changes = save_set_with_parts(set_, set_info)
+    if any(changes.values()):
+        lines.append(_changes_summary(changes))
+    else:
+        lines.append("Set items unchanged")
+    return lines, changes
+
+
+def _changes_summary(changes):
+    return (
+        "Set items: {created} created, {updated} updated,"
+        " {deleted} deleted".format_map(changes)
+    )
 
 
 class Command(LabelCommand):
     help = (
         "Add a new set or update an existing one by retrieving fresh data"
-        " from the external API."
+        " from the external API. Only the differences from the stored set"
+        " are written."
     )
     label = "lego_id"
 
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=1,
+            help="Number of worker processes loading sets in parallel.",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=1.0,
+            help=(
+                "Maximum number of API calls per second, shared by all"
+                " worker processes (with --jobs)."
+            ),
+        )
+
+    def handle(self, *labels, **options):
+        if options["jobs"] > 1:
+            output = self._handle_parallel(labels, options["jobs"], options["rate"])
+        else:
+            output = super().handle(*labels, **options)
+        refresh_inventory.enqueue()
+        return output
+
     def handle_label(self, lego_id, **options):
-        set_info = get_set_info(lego_id)
-
-        set_, created = get_set(lego_id)
-        if not created:
-            self.stdout.write(f"Updating existing set:\n{set_!r}")
-            if set_.name != set_info["name"]:
-                self.stdout.write(f"Set name changed: {set_info["name"]}")
-            if set_.image.origin_url != set_info["image_url"]:
-                self.stdout.write(f"Set image URL changed: {set_info["image_url"]}")
-            set_.parts.clear()
-
-        save_set_with_parts(set_, set_info)
+        lines, _ = _load_set(lego_id)
+        for line in lines:
+            self.stdout.write(line)
+
+    def _handle_parallel(self, labels, jobs, rate):
+        # every worker process opens its own database connection
+        connections.close_all()
+
+        totals = Counter()
+        failed = []
+        with ProcessPoolExecutor(
+            max_workers=jobs,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=set_rate_limiter,
+            initargs=(RateLimiter(1 / rate),),
+        ) as executor:
+            futures = {executor.submit(_load_set, lego_id): lego_id for lego_id in labels}
+            for num_done, future in enumerate(as_completed(futures), start=1):
+                lego_id = futures[future]
+                progress = f"[{num_done}/{len(labels)}] {lego_id}"
+                try:
+                    lines, changes = future.result()
+                except Exception as err:
+                    failed.append(lego_id)
+                    self.stderr.write(f"{progress} failed: {err!r}")
+                    continue
+                totals.update(changes)
+                self.stdout.write("\n".join([progress, *lines]))
+
+        self.stdout.write(
+            f"Loaded {len(labels) - len(failed)} of {len(labels)} sets."
+            f" {_changes_summary(totals)}"
+        )
+        if failed:
+            self.stderr.write(f"Failed: {", ".join(failed)}")
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from lego.caching import CATALOG_REVISION, bump_revision
+from lego.orm_utils import rebuild_set_aggregates
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the piece, unique part and color counts of all sets from"
+        " their set items."
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            num_sets = rebuild_set_aggregates()
+            bump_revision(CATALOG_REVISION)
+        self.stdout.write(f"Rebuilt aggregates of {num_sets} sets")
@@ -0,0 +1,76 @@
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import storages
+from django.core.management.base import BaseCommand
+
+from lego.images import download_and_store
+from lego.models import Image
+
+
+def _file_missing(storage, path):
+    try:
+        return not storage.exists(path)
+    except SuspiciousFileOperation:
+        return True
+
+
+class Command(BaseCommand):
+    help = (
+        "Download again the images that are not stored, or whose file is"
+        " missing from the media storage. Images are checked in batches by"
+        " pk and repaired images are saved batch by batch. The last pk of"
+        " each batch is printed, so an interrupted run can be resumed with"
+        " --after."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=100,
+            help="Number of images checked and downloaded at once.",
+        )
+        parser.add_argument(
+            "--retries",
+            type=int,
+            default=3,
+            help="Number of retries of downloads failing with transient errors.",
+        )
+        parser.add_argument(
+            "--after",
+            type=int,
+            default=0,
+            help="Only check images with a greater pk.",
+        )
+
+    def handle(self, *args, batch_size, retries, after, **options):
+        storage = storages["default"]
+        num_damaged = 0
+        num_repaired = 0
+        broken = []
+        last_pk = after
+        while batch := list(
+            Image.objects.filter(pk__gt=last_pk).order_by("pk")[:batch_size]
+        ):
+            last_pk = batch[-1].pk
+            damaged = [
+                image for image in batch
+                if image.path is None or _file_missing(storage, image.path)
+            ]
+            # a restored file also repairs the images of later batches sharing it
+            repaired = download_and_store(
+                [image for image in damaged if image.origin_url is not None],
+                retries,
+                reuse_stored=False,
+            )
+            repaired_pks = {image.pk for image in repaired}
+            num_damaged += len(damaged)
+            num_repaired += len(repaired_pks)
+            broken.extend(image.pk for image in damaged if image.pk not in repaired_pks)
+            self.stdout.write(
+                f"Checked images up to pk {last_pk} (resume with --after"
+                f" {last_pk}): {len(repaired_pks)} of {len(damaged)} repaired"
+            )
+
+        self.stdout.write(f"Repaired {num_repaired} of {num_damaged} images.")
+        if broken:
+            self.stderr.write(f"Still broken: {", ".join(map(str, broken))}")
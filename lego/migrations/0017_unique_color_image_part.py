@@ -0,0 +1,124 @@
+# Generated by Django 6.1 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+def _keepers(table, partition, order='"id"', where="TRUE", source=None):
+    """Return a subquery of the ids of the rows of `table` and the id of the
+    first row of their group (`keeper_id`). Rows are grouped by `partition`.
+    """
+    return f"""(
+  SELECT "id", FIRST_VALUE("id") OVER (PARTITION BY {partition} ORDER BY {order}) AS "keeper_id"
+  FROM {source or f'"{table}"'}
+  WHERE {where}
+) AS "duplicate"
+"""
+
+
+def _deduplicate(table, keepers, references):
+    """Return the SQL statements pointing the foreign keys `references`
+    to the first row of each group of duplicates of `table`, then deleting
+    the other rows.
+    """
+    statements = [
+        f"""UPDATE "{ref_table}" SET "{ref_column}" = "duplicate"."keeper_id"
+FROM {keepers}
+WHERE "{ref_table}"."{ref_column}" = "duplicate"."id" AND "duplicate"."id" <> "duplicate"."keeper_id";"""
+        for ref_table, ref_column in references
+    ]
+    statements.append(
+        f"""DELETE FROM "{table}"
+USING {keepers}
+WHERE "{table}"."id" = "duplicate"."id" AND "duplicate"."id" <> "duplicate"."keeper_id";"""
+    )
+    return statements
+
+
+# parts are grouped by the color they will have once colors are merged
+PART_KEEPERS = _keepers(
+    "lego_legopart",
+    '"shape_id", "first_color_id"',
+    source=""""lego_legopart" LEFT JOIN (
+    SELECT "id" AS "color_id", MIN("id") OVER (PARTITION BY "name") AS "first_color_id"
+    FROM "lego_color"
+  ) AS "color" USING ("color_id")""",
+)
+
+# items of the same set whose parts are merged are merged first, as an item
+# is unique by set and part
+SET_ITEM_GROUPS = f"""(
+  SELECT
+    "lego_setitem"."id",
+    MIN("lego_setitem"."id") OVER "item_group" AS "keeper_id",
+    SUM("lego_setitem"."quantity") OVER "item_group" AS "quantity"
+  FROM "lego_setitem"
+  JOIN {PART_KEEPERS} ON "lego_setitem"."part_id" = "duplicate"."id"
+  WINDOW "item_group" AS (PARTITION BY "lego_setitem"."set_id", "duplicate"."keeper_id")
+) AS "item_group"
+"""
+
+MERGE_SET_ITEMS = [
+    f"""UPDATE "lego_setitem" SET "quantity" = "item_group"."quantity"
+FROM {SET_ITEM_GROUPS}
+WHERE "lego_setitem"."id" = "item_group"."id" AND "item_group"."id" = "item_group"."keeper_id";""",
+    f"""DELETE FROM "lego_setitem"
+USING {SET_ITEM_GROUPS}
+WHERE "lego_setitem"."id" = "item_group"."id" AND "item_group"."id" <> "item_group"."keeper_id";""",
+]
+
+# rows made duplicate by the new unique constraints, e.g. images created per
+# distinct (static_path, origin_url) pair by migration 0012, are merged first
+DEDUPLICATE = [
+    *MERGE_SET_ITEMS,
+    *_deduplicate("lego_legopart", PART_KEEPERS, [("lego_setitem", "part_id")]),
+    *_deduplicate(
+        "lego_color",
+        _keepers("lego_color", '"name"'),
+        [("lego_legopart", "color_id")],
+    ),
+    *_deduplicate(
+        "lego_image",
+        _keepers(
+            "lego_image",
+            '"origin_url"',
+            order='"path" IS NULL, "id"',    # keep a stored image if there is one
+            where='"origin_url" IS NOT NULL',
+        ),
+        [("lego_legopart", "image_id"), ("lego_legoset", "image_id")],
+    ),
+    # check the deferred foreign keys now, before altering the tables
+    "SET CONSTRAINTS ALL IMMEDIATE;",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lego', '0016_db_level_on_delete'),
+    ]
+
+    operations = [
+        migrations.RunSQL(sql=DEDUPLICATE, reverse_sql=migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name='color',
+            name='name',
+            field=models.CharField(max_length=30, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='origin_url',
+            field=models.URLField(null=True, unique=True),
+        ),
+        migrations.RemoveConstraint(
+            model_name='legopart',
+            name='unique_shape_color',
+        ),
+        migrations.AddConstraint(
+            model_name='legopart',
+            constraint=models.UniqueConstraint(
+                fields=('shape', 'color'),
+                name='unique_shape_color',
+                nulls_distinct=False,
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.1 on 2026-10-18 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lego', '0019_image_size_avif'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='legoset',
+            name='sprite_offsets',
+            field=models.JSONField(null=True),
+        ),
+        migrations.AddField(
+            model_name='legoset',
+            name='sprite_path',
+            field=models.CharField(max_length=150, null=True),
+        ),
+    ]
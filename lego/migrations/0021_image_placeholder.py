@@ -0,0 +1,18 @@
+# Generated by Django 6.1 on 2026-10-18 12:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lego', '0020_legoset_sprite_sheet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='placeholder',
+            field=models.TextField(null=True),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 6.1 on 2026-10-18 16:05
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def compute_aggregates(apps, schema_editor):
+    LegoSet = apps.get_model("lego", "LegoSet")
+    SetItem = apps.get_model("lego", "SetItem")
+    set_items = SetItem.objects.filter(set=OuterRef("pk")).order_by().values("set")
+    LegoSet.objects.update(
+        num_pieces=Coalesce(
+            Subquery(set_items.annotate(total=Sum("quantity")).values("total")), 0
+        ),
+        num_unique_parts=Coalesce(
+            Subquery(set_items.annotate(total=Count("part")).values("total")), 0
+        ),
+        num_colors=Coalesce(
+            Subquery(
+                set_items
+                .annotate(total=Count("part__color", distinct=True))
+                .values("total")
+            ),
+            0,
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lego', '0023_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='legoset',
+            name='num_colors',
+            field=models.PositiveSmallIntegerField(db_default=0, default=0),
+        ),
+        migrations.AddField(
+            model_name='legoset',
+            name='num_pieces',
+            field=models.PositiveIntegerField(db_default=0, default=0),
+        ),
+        migrations.AddField(
+            model_name='legoset',
+            name='num_unique_parts',
+            field=models.PositiveIntegerField(db_default=0, default=0),
+        ),
+        migrations.RunPython(compute_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 6.1 on 2026-10-18 16:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lego', '0024_legoset_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                'CREATE MATERIALIZED VIEW "lego_inventory" AS'
+                ' SELECT "part_id", SUM("quantity") AS "quantity",'
+                ' COUNT(*) AS "num_sets"'
+                ' FROM "lego_setitem" GROUP BY "part_id"',
+                # a unique index is required to refresh the view concurrently
+                'CREATE UNIQUE INDEX "inventory_part" ON "lego_inventory" ("part_id")',
+                'CREATE INDEX "inventory_quantity"'
+                ' ON "lego_inventory" ("quantity" DESC, "part_id")',
+            ],
+            reverse_sql='DROP MATERIALIZED VIEW "lego_inventory"',
+        ),
+        migrations.CreateModel(
+            name='InventoryItem',
+            fields=[
+                ('part', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='inventory', serialize=False, to='lego.legopart')),
+                ('quantity', models.PositiveIntegerField()),
+                ('num_sets', models.PositiveIntegerField()),
+            ],
+            options={
+                'db_table': 'lego_inventory',
+                'managed': False,
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.1 on 2026-10-18 20:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lego', '0026_revision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='legoset',
+            name='items_revision',
+            field=models.PositiveBigIntegerField(db_default=0, default=0),
+        ),
+    ]
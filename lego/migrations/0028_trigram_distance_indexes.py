@@ -0,0 +1,27 @@
+# Generated by Django 6.1 on 2026-10-18 21:22
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lego', '0027_legoset_items_revision'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='color',
+            index=django.contrib.postgres.indexes.GistIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gist_trgm_ops'), name='color_name_trgm_gist'),
+        ),
+        migrations.AddIndex(
+            model_name='legoset',
+            index=django.contrib.postgres.indexes.GistIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gist_trgm_ops'), name='legoset_name_trgm_gist'),
+        ),
+        migrations.AddIndex(
+            model_name='shape',
+            index=django.contrib.postgres.indexes.GistIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gist_trgm_ops'), name='shape_name_trgm_gist'),
+        ),
+    ]
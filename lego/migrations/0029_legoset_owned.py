@@ -0,0 +1,49 @@
+# Generated by Django 6.1 on 2026-10-18 21:24
+
+from django.db import migrations, models
+
+INVENTORY_QUERY = (
+    'SELECT "part_id", SUM("quantity") AS "quantity", COUNT(*) AS "num_sets"'
+    ' FROM "lego_setitem"'
+)
+INVENTORY_INDEXES = [
+    # a unique index is required to refresh the view concurrently
+    'CREATE UNIQUE INDEX "inventory_part" ON "lego_inventory" ("part_id")',
+    'CREATE INDEX "inventory_quantity"'
+    ' ON "lego_inventory" ("quantity" DESC, "part_id")',
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lego', '0028_trigram_distance_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='legoset',
+            name='owned',
+            field=models.BooleanField(db_default=False, default=False),
+        ),
+        # sets stored before the catalog import were all added to the collection
+        migrations.RunSQL(
+            sql='UPDATE "lego_legoset" SET "owned" = TRUE',
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            sql=[
+                'DROP MATERIALIZED VIEW "lego_inventory"',
+                'CREATE MATERIALIZED VIEW "lego_inventory" AS ' + INVENTORY_QUERY
+                + ' JOIN "lego_legoset" ON "lego_legoset"."id" = "lego_setitem"."set_id"'
+                ' WHERE "lego_legoset"."owned" GROUP BY "part_id"',
+                *INVENTORY_INDEXES,
+            ],
+            reverse_sql=[
+                'DROP MATERIALIZED VIEW "lego_inventory"',
+                'CREATE MATERIALIZED VIEW "lego_inventory" AS ' + INVENTORY_QUERY
+                + ' GROUP BY "part_id"',
+                *INVENTORY_INDEXES,
+            ],
+        ),
+    ]
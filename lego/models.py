@@ -1,4 +1,6 @@
+from django.contrib.postgres.indexes import GinIndex, GistIndex, OpClass
 from django.db import models
+from django.db.models.functions import Now, Upper
 from django.urls import reverse
 
 
@@ -7,6 +9,31 @@ class NumericPrefix(models.Func):
     template = "%(function)s(%(expressions)s from '^\\d+')"
 
 
+def trigram_index(field_name, name):
+    """Return a trigram index usable by `icontains` lookups on `field_name`,
+    which compare upper-cased values.
+    """
+    return GinIndex(OpClass(Upper(field_name), name="gin_trgm_ops"), name=name)
+
+
+class WordDistance(models.Func):
+    """One minus the trigram word similarity of the second expression to the
+    first, written `first <->> second` so a GiST index on the first can
+    return rows in distance order.
+    """
+
+    function = ""
+    arg_joiner = " <->> "
+    output_field = models.FloatField()
+
+
+def trigram_distance_index(field_name, name):
+    """Return a trigram index usable to order by the `WordDistance` of the
+    upper-cased values of `field_name` to a string.
+    """
+    return GistIndex(OpClass(Upper(field_name), name="gist_trgm_ops"), name=name)
+
+
 class Shape(models.Model):
     lego_id = models.CharField(max_length=30, unique=True)
     name = models.CharField(max_length=150)
@@ -20,6 +47,8 @@ class Shape(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=["num_code"]),
+            trigram_index("name", "shape_name_trgm"),
+            trigram_distance_index("name", "shape_name_trgm_gist"),
         ]
         ordering = ["num_code"]
 
@@ -31,7 +60,13 @@ class Shape(models.Model):
 
 
 class Color(models.Model):
-    name = models.CharField(max_length=30)
+    name = models.CharField(max_length=30, unique=True)
+
+    class Meta:
+        indexes = [
+            trigram_index("name", "color_name_trgm"),
+            trigram_distance_index("name", "color_name_trgm_gist"),
+        ]
 
     def __str__(self):
         return self.name
@@ -42,7 +77,12 @@ class Color(models.Model):
 
 class Image(models.Model):
     path = models.CharField(max_length=150, null=True)
-    origin_url = models.URLField(null=True)
+    origin_url = models.URLField(null=True, unique=True)
+    content_hash = models.CharField(max_length=64, null=True, db_index=True)
+    width = models.PositiveSmallIntegerField(null=True)
+    height = models.PositiveSmallIntegerField(null=True)
+    has_avif = models.BooleanField(default=False, db_default=False)
+    placeholder = models.TextField(null=True)
 
     class Meta:
         constraints = [
@@ -68,11 +108,14 @@ class LegoPart(models.Model):
     shape = models.ForeignKey(Shape, on_delete=models.DB_CASCADE)
     color = models.ForeignKey(Color, on_delete=models.DB_SET_NULL, null=True)
     image = models.ForeignKey(Image, on_delete=models.DB_SET_NULL, null=True)
+    updated_at = models.DateTimeField(auto_now=True, db_default=Now())
 
     class Meta:
         constraints = [
             models.UniqueConstraint(
-                fields=["shape", "color"], name="unique_shape_color"
+                fields=["shape", "color"],
+                name="unique_shape_color",
+                nulls_distinct=False,
             ),
         ]
         ordering = ["shape"]
@@ -94,9 +137,25 @@ class LegoSet(models.Model):
     lego_id = models.CharField(max_length=30, unique=True)
     name = models.CharField(max_length=150)
     image = models.ForeignKey(Image, on_delete=models.DB_SET_NULL, null=True)
+    sprite_path = models.CharField(max_length=150, null=True)
+    sprite_offsets = models.JSONField(null=True)
+    num_pieces = models.PositiveIntegerField(default=0, db_default=0)
+    num_unique_parts = models.PositiveIntegerField(default=0, db_default=0)
+    num_colors = models.PositiveSmallIntegerField(default=0, db_default=0)
+    # in the collection: added by `add_set` or `loadset`, not by `loadcatalog`
+    owned = models.BooleanField(default=False, db_default=False)
+    # number of the "inventory" `Revision` that last changed its set items
+    items_revision = models.PositiveBigIntegerField(default=0, db_default=0)
+    updated_at = models.DateTimeField(auto_now=True, db_default=Now())
 
     parts = models.ManyToManyField(LegoPart, through="SetItem", related_name="sets")
 
+    class Meta:
+        indexes = [
+            trigram_index("name", "legoset_name_trgm"),
+            trigram_distance_index("name", "legoset_name_trgm_gist"),
+        ]
+
     def get_absolute_url(self):
         return reverse("set_detail", kwargs={"lego_id": self.lego_id})
 
@@ -119,6 +178,40 @@ class SetItem(models.Model):
         return _repr(self)
 
 
+class InventoryItem(models.Model):
+    """Total quantity of a part in all sets, from the materialized view
+    `lego_inventory`, refreshed by the `refresh_inventory` task.
+    """
+    part = models.OneToOneField(
+        LegoPart,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        related_name="inventory",
+    )
+    quantity = models.PositiveIntegerField()
+    num_sets = models.PositiveIntegerField()
+
+    class Meta:
+        managed = False
+        db_table = "lego_inventory"
+
+    def __repr__(self):
+        return _repr(self)
+
+
+class Revision(models.Model):
+    """Number of changes of data shared by all processes, e.g. of the whole
+    catalog loaded by `loadcatalog`, and when it changed last. Bumped by
+    `lego.caching.bump_revision` in the transaction of the change.
+    """
+    name = models.CharField(max_length=30, primary_key=True)
+    number = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField()
+
+    def __repr__(self):
+        return _repr(self)
+
+
 def _repr(instance, field_names=None):
     if field_names is None:
         field_names = (field.attname for field in instance._meta.fields)
@@ -1,8 +1,29 @@
 import logging
 
+from django.db import OperationalError, connection, transaction
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.tasks import task
+
 from .api_calls import get_set_parts
-from .images import store_set_image, store_part_image
-from .models import Shape, Color, Image, LegoPart, LegoSet
+from .caching import (
+    bump_image_versions,
+    bump_revision,
+    bump_shape_versions,
+    bump_versions,
+)
+from .images import (
+    SPRITE_SHEETS_ENABLED,
+    build_sprite_sheet,
+    store_part_images,
+    store_set_image,
+)
+from .models import Shape, Color, Image, LegoPart, LegoSet, SetItem
+
+REFRESH_INVENTORY = 'REFRESH MATERIALIZED VIEW CONCURRENTLY "lego_inventory"'
+INVENTORY_REVISION = "inventory"
+DEADLOCK_DETECTED = "40P01"  # SQLSTATE of a transaction aborted by PostgreSQL
+MAX_ATTEMPTS = 3
 
 logger = logging.getLogger(__name__)
 
@@ -16,68 +37,336 @@ def get_set(lego_id):
     return set_, created
 
 
+@task
+def import_set(lego_id, set_info):
+    """Add or update the set with the given `lego_id` and its inventory."""
+
+    set_, _ = get_set(lego_id)
+    added = add_to_collection(set_)
+    changes = save_set_with_parts(set_, set_info)
+    if added or any(changes.values()):
+        refresh_inventory.enqueue()
+    return changes
+
+
+def add_to_collection(set_):
+    """Mark `set_` as owned, so that its items count in the inventory of
+    the collection. Return whether it was not owned before.
+    """
+    if set_.owned:
+        return False
+    set_.owned = True
+    return bool(LegoSet.objects.filter(pk=set_.pk, owned=False).update(owned=True))
+
+
+@task
+def refresh_inventory():
+    """Refresh the inventory of the parts of all owned sets, without
+    blocking its readers.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(REFRESH_INVENTORY)
+
+
 def save_set_with_parts(set_, set_info):
+    """Save `set_` with its inventory retrieved from the external API.
+
+    All shapes, colors, images, parts and set items of the inventory are
+    resolved in bulk, using a fixed number of queries per set. Only the
+    differences from the stored data are written. Return the numbers of
+    created, updated and deleted set items.
+
+    Concurrent imports of sets sharing new parts may deadlock; the
+    transaction aborted by the database is then run again.
+    """
+    items = _get_items(get_set_parts(set_.lego_id))
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            return _save_set_with_items(set_, set_info, items)
+        except OperationalError as error:
+            if attempt == MAX_ATTEMPTS or not _is_deadlock(error):
+                raise
+            logger.warning(f"Deadlock saving {set_!r}, attempt {attempt}: {error}")
+            set_.refresh_from_db()
+
+
+def _is_deadlock(error):
+    return getattr(error.__cause__, "sqlstate", None) == DEADLOCK_DETECTED
+
+
+@transaction.atomic
+def _save_set_with_items(set_, set_info, items):
     image_url = set_info["image_url"]
     image_outdated = image_url and (set_.image is None or set_.image.origin_url != image_url)
     if image_outdated:
         set_.image = _get_image(image_url)
 
-    set_.name = set_info["name"]
-    set_.save()
+    set_changed = image_outdated or set_.name != set_info["name"]
+    if set_changed:
+        set_.name = set_info["name"]
+        set_.save()
     if image_outdated:
         store_set_image.enqueue(pk=set_.pk)
 
-    for item in get_set_parts(set_.lego_id):
+    shapes = _get_shapes(items)
+    colors = _get_colors(items)
+    parts = _get_parts(items, shapes, colors)
+    changes = _update_set_items(set_, items, parts)
+    if set_changed or any(changes.values()):
+        bump_versions("set", [set_.pk])
+    if set_changed:    # part pages show the name and image of the set
+        bump_versions("part", [part.pk for part in parts.values()])
+    if SPRITE_SHEETS_ENABLED and any(changes.values()):
+        build_sprite_sheet.enqueue(set_pk=set_.pk)
+    if any(changes.values()):
+        stamp_items_revision(LegoSet.objects.filter(pk=set_.pk))
+    return changes
+
+
+def stamp_items_revision(sets):
+    """Record a change of the set items of `sets` with a new "inventory"
+    revision, read by `lego.vectors`. Return the revision number.
+
+    The revision stays locked until the transaction commits, so it must be
+    its last write, after the rows of `sets` are locked by earlier writes:
+    transactions that bump it never wait for each other while holding it.
+    """
+    number = bump_revision(INVENTORY_REVISION)
+    sets.update(items_revision=number)
+    return number
+
+
+def _get_items(set_parts):
+    """Return the inventory entries of `set_parts`, without spare parts."""
+
+    items = []
+    for item in set_parts:
         if item.get("is_spare"):
             logger.info(f"Skipping spare part: {item["name"]}, {item.get("color_name")}")
             continue
-        shape = _get_shape(lego_id=item["lego_id"], name=item["name"])
-        color_name = item.get("color_name")
-        if color_name:
-            color, created = Color.objects.get_or_create(name=color_name)
-            if created:
-                logger.info(f"Created: {color!r}")
-        else:
-            color = None
-        part = _get_part(shape=shape, color=color, image_url=item["image_url"])
-        set_.parts.add(part, through_defaults={"quantity": item["quantity"]})
+        items.append(item)
+    return items
 
 
-def _get_shape(lego_id, name):
-    """Get, update or create a `Shape` with given `lego_id` and `name`."""
+def _part_key(item):
+    return item["lego_id"], item.get("color_name")
 
-    try:
-        shape = Shape.objects.get(lego_id=lego_id)
-        if shape.name != name:
+
+def _get_shapes(items):
+    """Get, update or create the `Shape`s of `items`, mapped by `lego_id`.
+
+    Like the other shared rows, shapes are written in the order of their
+    unique key, so that concurrent imports lock them in the same order.
+    """
+    names = {item["lego_id"]: item["name"] for item in items}
+    shapes = Shape.objects.in_bulk(list(names), field_name="lego_id")
+
+    outdated_shapes = []
+    new_shapes = []
+    for lego_id, name in sorted(names.items()):
+        shape = shapes.get(lego_id)
+        if shape is None:
+            new_shapes.append(Shape(lego_id=lego_id, name=name))
+        elif shape.name != name:
             logger.info(f"Outdated name: {shape!r}")
             shape.name = name
-            shape.save()
-            logger.info(f"Updated name: {shape!r}")
-    except Shape.DoesNotExist:
-        shape = Shape.objects.create(lego_id=lego_id, name=name)
+            outdated_shapes.append(shape)
+
+    Shape.objects.bulk_update(outdated_shapes, ["name"])
+    for shape in outdated_shapes:
+        logger.info(f"Updated name: {shape!r}")
+    if outdated_shapes:
+        bump_shape_versions([shape.pk for shape in outdated_shapes])
+
+    Shape.objects.bulk_create(
+        new_shapes,
+        update_conflicts=True,
+        unique_fields=["lego_id"],
+        update_fields=["name"],
+    )
+    for shape in new_shapes:
         logger.info(f"Created: {shape!r}")
-    return shape
+        shapes[shape.lego_id] = shape
+
+    return shapes
+
 
+def _get_colors(items):
+    """Get or create the `Color`s of `items`, mapped by name."""
 
-def _get_part(shape, color, image_url):
-    """Get, update or create a `LegoPart` with given `shape`, `color` and
-    image URL.
+    names = dict.fromkeys(
+        item["color_name"] for item in items if item.get("color_name")
+    )
+    colors = {color.name: color for color in Color.objects.filter(name__in=names)}
+
+    new_colors = Color.objects.bulk_create(
+        (Color(name=name) for name in sorted(names) if name not in colors),
+        update_conflicts=True,
+        unique_fields=["name"],
+        update_fields=["name"],
+    )
+    for color in new_colors:
+        logger.info(f"Created: {color!r}")
+        colors[color.name] = color
+
+    return colors
+
+
+def _get_parts(items, shapes, colors):
+    """Get, update or create the `LegoPart`s of `items`, mapped by
+    `(lego_id, color_name)`.
     """
-    try:
-        part = LegoPart.objects.get(shape=shape, color=color)
+    image_urls = {_part_key(item): item["image_url"] for item in items}
+    existing_parts = {
+        (part.shape.lego_id, part.color and part.color.name): part
+        for part in (
+            LegoPart.objects
+            .select_related("shape", "color", "image")
+            .filter(shape__in=list(shapes.values()))
+        )
+    }
+
+    parts = {}
+    outdated_parts = {}
+    new_keys = []
+    for key, image_url in image_urls.items():
+        part = existing_parts.get(key)
+        if part is None:
+            new_keys.append(key)
+            continue
+        parts[key] = part
         if image_url and (part.image is None or part.image.origin_url != image_url):
             logger.info(f"Outdated image: {part!r}")
-            part.image = _get_image(image_url)
-            part.save()
-            logger.info(f"Updated image: {part!r}")
-            store_part_image.enqueue(pk=part.pk)
-    except LegoPart.DoesNotExist:
-        part = LegoPart.objects.create(
-            shape=shape, color=color, image=_get_image(image_url)
-        )
+            outdated_parts[key] = part
+
+    images = _get_images(image_urls[key] for key in [*outdated_parts, *new_keys])
+    new_keys.sort(key=lambda key: (shapes[key[0]].pk, key[1] and colors[key[1]].pk or 0))
+
+    for key, part in outdated_parts.items():
+        part.image = images[image_urls[key]]
+    LegoPart.objects.bulk_update(
+        sorted(outdated_parts.values(), key=lambda part: part.pk), ["image"]
+    )
+    for part in outdated_parts.values():
+        logger.info(f"Updated image: {part!r}")
+    if outdated_parts:
+        bump_image_versions([part.image.pk for part in outdated_parts.values()])
+
+    new_parts = LegoPart.objects.bulk_create(
+        (
+            LegoPart(
+                shape=shapes[lego_id],
+                color=colors[color_name] if color_name else None,
+                image=images.get(image_urls[(lego_id, color_name)]),
+            )
+            for lego_id, color_name in new_keys
+        ),
+        update_conflicts=True,
+        unique_fields=["shape", "color"],
+        update_fields=["image"],
+    )
+    for key, part in zip(new_keys, new_parts):
         logger.info(f"Created: {part!r}")
-        store_part_image.enqueue(pk=part.pk)
-    return part
+        parts[key] = part
+
+    # one task stores the images of all parts of the set
+    image_part_pks = [
+        part.pk
+        for part in [*outdated_parts.values(), *new_parts]
+        if part.image is not None
+    ]
+    if image_part_pks:
+        store_part_images.enqueue(pks=image_part_pks)
+
+    return parts
+
+
+def _update_set_items(set_, items, parts):
+    """Reconcile the `SetItem`s of `set_` with `items`: create missing
+    items, update changed quantities and delete items of parts no longer
+    in the set. Return the numbers of created, updated and deleted items.
+    """
+    quantities = {}
+    for item in items:
+        quantities.setdefault(parts[_part_key(item)], item["quantity"])
+
+    set_items = {}
+    deleted_items = []
+    for set_item in set_.setitem_set.order_by("pk"):
+        if set_item.part_id in set_items:    # duplicate item
+            deleted_items.append(set_item)
+        else:
+            set_items[set_item.part_id] = set_item
+
+    new_items = []
+    updated_items = []
+    for part, quantity in quantities.items():
+        set_item = set_items.pop(part.pk, None)
+        if set_item is None:
+            new_items.append(SetItem(set=set_, part=part, quantity=quantity))
+        elif set_item.quantity != quantity:
+            set_item.quantity = quantity
+            updated_items.append(set_item)
+    deleted_items.extend(set_items.values())
+
+    SetItem.objects.bulk_create(new_items)
+    SetItem.objects.bulk_update(updated_items, ["quantity"])
+    if deleted_items:
+        SetItem.objects.filter(pk__in=[item.pk for item in deleted_items]).delete()
+    bump_versions(
+        "part",
+        [item.part_id for item in (*new_items, *updated_items, *deleted_items)],
+    )
+
+    _update_aggregates(set_, quantities)
+
+    changes = {
+        "created": len(new_items),
+        "updated": len(updated_items),
+        "deleted": len(deleted_items),
+    }
+    if any(changes.values()):
+        logger.info(f"Updated items of {set_!r}: {changes}")
+    return changes
+
+
+def _update_aggregates(set_, quantities):
+    """Update the aggregates of `set_` from the `quantities` of its parts."""
+    aggregates = {
+        "num_pieces": sum(quantities.values()),
+        "num_unique_parts": len(quantities),
+        "num_colors": len({part.color_id for part in quantities if part.color_id}),
+    }
+    if all(getattr(set_, field) == value for field, value in aggregates.items()):
+        return
+
+    for field, value in aggregates.items():
+        setattr(set_, field, value)
+    set_.save(update_fields=[*aggregates, "updated_at"])
+    logger.info(f"Updated aggregates of {set_!r}")
+
+
+def rebuild_set_aggregates():
+    """Recompute the aggregates of all sets from their set items. Return
+    the number of sets.
+    """
+    set_items = SetItem.objects.filter(set=OuterRef("pk")).order_by().values("set")
+    return LegoSet.objects.update(
+        num_pieces=Coalesce(
+            Subquery(set_items.annotate(total=Sum("quantity")).values("total")), 0
+        ),
+        num_unique_parts=Coalesce(
+            Subquery(set_items.annotate(total=Count("part")).values("total")), 0
+        ),
+        num_colors=Coalesce(
+            Subquery(
+                set_items
+                .annotate(total=Count("part__color", distinct=True))
+                .values("total")
+            ),
+            0,
+        ),
+    )
 
 
 def _get_image(url):
@@ -90,3 +379,25 @@ def _get_image(url):
     if created:
         logger.info(f"Created: {image!r}")
     return image
+
+
+def _get_images(urls):
+    """Get or create `Image`s with the given URLs, mapped by URL."""
+
+    urls = dict.fromkeys(url for url in urls if url)
+    images = {
+        image.origin_url: image
+        for image in Image.objects.filter(origin_url__in=urls)
+    }
+
+    new_images = Image.objects.bulk_create(
+        (Image(origin_url=url) for url in sorted(urls) if url not in images),
+        update_conflicts=True,
+        unique_fields=["origin_url"],
+        update_fields=["origin_url"],
+    )
+    for image in new_images:
+        logger.info(f"Created: {image!r}")
+        images[image.origin_url] = image
+
+    return images
@@ -0,0 +1,56 @@
+class BoundedPage:
+    """A page of `per_page` rows of `queryset` that is fetched without
+    counting all rows. Only the first `max_rows` rows are paginated.
+
+    One extra row is fetched to find out whether there is a next page.
+    """
+
+    def __init__(self, queryset, number, per_page, max_rows):
+        self.number = number
+        offset = (number - 1) * per_page
+        limit = min(per_page, max_rows - offset)
+        rows = list(queryset[offset:offset + limit + 1]) if limit > 0 else []
+        self.object_list = rows[:limit]
+        self._has_next = len(rows) > limit and offset + limit < max_rows
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self.number > 1
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+
+class KeysetPage:
+    """A page of `per_page` rows of `queryset`, ordered by descending pk,
+    that follow the row with pk `after`. The cost of a page does not depend
+    on how many rows precede it.
+    """
+
+    def __init__(self, queryset, after, per_page):
+        if after is not None:
+            queryset = queryset.filter(pk__lt=after)
+        rows = list(queryset.order_by("-pk")[:per_page + 1])
+        self.object_list = rows[:per_page]
+        self.after = after
+        self.next_after = rows[per_page - 1].pk if len(rows) > per_page else None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_after is not None
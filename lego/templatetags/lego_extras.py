@@ -1,3 +1,79 @@
 from django import template
+from django.conf import settings
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+from lego.images import DEFAULT_IMAGE_FORMAT, THUMBNAIL_SIZES, variant_path
 
 register = template.Library()
+
+
+def _srcset(image, image_format):
+    longest_side = max(image.width, image.height)
+    candidates = [
+        (
+            variant_path(image.path, size, image_format),
+            image.width * size // longest_side,
+        )
+        for size in THUMBNAIL_SIZES
+        if size < longest_side
+    ]
+    candidates.append((variant_path(image.path, None, image_format), image.width))
+    return ", ".join(
+        f"{settings.MEDIA_URL}{path} {width}w" for path, width in candidates
+    )
+
+
+@register.simple_tag
+def responsive_image(image, size, loading="lazy"):
+    """Render stored `image` scaled to fit in `size` x `size` CSS pixels. The
+    browser picks the smallest stored variant that is sharp at that size.
+    """
+    attrs = {"src": f"{settings.MEDIA_URL}{image.path}", "loading": loading}
+    if image.width is None:
+        return format_html("<img{}>", flatatt(attrs))
+
+    scale_factor = min(size / max(image.width, image.height), 1)
+    width = round(image.width * scale_factor)
+    attrs |= {
+        "srcset": _srcset(image, DEFAULT_IMAGE_FORMAT),
+        "sizes": f"{width}px",
+        "width": width,
+        "height": round(image.height * scale_factor),
+    }
+    if image.placeholder:
+        attrs |= {
+            "class": "placeholder",
+            "style": f"--placeholder: url({image.placeholder})",
+            "onload": "this.classList.remove('placeholder')",
+        }
+    if not image.has_avif:
+        return format_html("<img{}>", flatatt(attrs))
+
+    return format_html(
+        '<picture><source type="image/avif"{}><img{}></picture>',
+        flatatt({"srcset": _srcset(image, "avif"), "sizes": attrs["sizes"]}),
+        flatatt(attrs),
+    )
+
+
+@register.simple_tag
+def sprite_image(legoset, part):
+    """Render `part` as a cell of the sprite sheet of `legoset`, which the
+    enclosing element sets as `--sprite-sheet`. Render nothing if the sheet
+    does not contain the part.
+    """
+    if not legoset.sprite_path or str(part.pk) not in legoset.sprite_offsets:
+        return ""
+
+    x, y, width, height = legoset.sprite_offsets[str(part.pk)]
+    return format_html(
+        '<span class="sprite" role="img" aria-label="{}"'
+        ' style="background-position: {}px {}px; width: {}px; height: {}px">'
+        "</span>",
+        part,
+        -x,
+        -y,
+        width,
+        height,
+    )
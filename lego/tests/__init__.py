@@ -29,6 +29,30 @@ test_settings = override_settings(
     PASSWORD_HASHERS = [
         "django.contrib.auth.hashers.MD5PasswordHasher",
     ],
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+        },
+    },
+)
+
+# cache page fragments, e.g. to test their invalidation
+cached_fragments = override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "lego-tests",
+        },
+    },
+)
+
+# run background tasks (e.g. set import) right when they are enqueued
+immediate_tasks = override_settings(
+    TASKS={
+        "default": {
+            "BACKEND": "django.tasks.backends.immediate.ImmediateBackend",
+        },
+    },
 )
 
 # note: logging settings cannot be simply overridden with `override_settings`
@@ -255,7 +279,7 @@ def _info_stub(set_lego_id):
 
 
 def get_set_info_mock():
-    return patch("lego.views.get_set_info", side_effect=_info_stub)
+    return patch("lego.views.aget_set_info", side_effect=_info_stub)
 
 
 def _parts_stub(set_lego_id):
@@ -32,3 +32,20 @@ class LegoPartFactory(DjangoModelFactory):
     shape = factory.SubFactory(ShapeFactory)
     color = factory.SubFactory(ColorFactory)
     image = factory.SubFactory(ImageFactory)
+
+
+class LegoSetFactory(DjangoModelFactory):
+    class Meta:
+        model = "lego.LegoSet"
+
+    lego_id = factory.Sequence(lambda n: f"{n:04}-1")
+    name = factory.Sequence(lambda n: f"Test Set {n}")
+    image = factory.SubFactory(ImageFactory)
+
+
+class SetItemFactory(DjangoModelFactory):
+    class Meta:
+        model = "lego.SetItem"
+
+    set = factory.SubFactory(LegoSetFactory)
+    part = factory.SubFactory(LegoPartFactory)
@@ -0,0 +1,228 @@
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import Mock, patch
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+from django.test import SimpleTestCase
+
+from lego.api_calls import (
+    PAGE_SIZE,
+    ApiError,
+    RateLimiter,
+    ResponseCache,
+    _aget_response,
+    _async_client,
+    _get_response,
+    _get_paginated_data,
+    aclose_async_client,
+    aget_set_info,
+    get_set_info,
+    get_set_parts,
+)
+
+from . import test_settings
+
+
+def _response_stub(num_results):
+    def stub(url, session=None):
+        page = int(parse_qs(urlparse(url).query)["page"][0])
+        start = (page - 1) * PAGE_SIZE
+        stop = min(page * PAGE_SIZE, num_results)
+        return {"count": num_results, "results": list(range(start, stop))}
+
+    return stub
+
+
+@test_settings
+class TestPaginatedData(SimpleTestCase):
+    def test_single_page(self):
+        with patch(
+            "lego.api_calls._get_response", side_effect=_response_stub(10)
+        ) as mock:
+            results = list(_get_paginated_data("test://api.test/items/", None))
+
+        self.assertEqual(results, list(range(10)))
+        mock.assert_called_once()
+
+    def test_multiple_pages_in_order(self):
+        num_results = 5 * PAGE_SIZE + 1
+        with patch(
+            "lego.api_calls._get_response", side_effect=_response_stub(num_results)
+        ) as mock:
+            results = list(
+                _get_paginated_data("test://api.test/items/", None, concurrency=3)
+            )
+
+        self.assertEqual(results, list(range(num_results)))
+        self.assertEqual(mock.call_count, 6)
+
+    def test_page_urls(self):
+        with patch(
+            "lego.api_calls._get_response", side_effect=_response_stub(PAGE_SIZE + 1)
+        ) as mock:
+            list(_get_paginated_data("test://api.test/items/", None))
+
+        urls = sorted(call.args[0] for call in mock.call_args_list)
+        self.assertEqual(
+            urls,
+            [
+                f"test://api.test/items/?page=1&page_size={PAGE_SIZE}",
+                f"test://api.test/items/?page=2&page_size={PAGE_SIZE}",
+            ],
+        )
+
+
+_MINIFIG = {
+    "set_num": "fig-0008",
+    "set_name": "Man, Brown Hat",
+    "set_img_url": "test://cdn.test/img/fig-0008.jpg",
+    "quantity": 1,
+}
+_PART = {
+    "part": {
+        "part_num": "2345",
+        "name": "Brick 2 x 4",
+        "part_img_url": "test://cdn.test/img/2345R.jpg",
+    },
+    "color": {"name": "Red"},
+    "quantity": 2,
+    "is_spare": False,
+}
+
+
+def _inventory_stub(url, session=None):
+    results = [_MINIFIG] if "/minifigs/" in url else [_PART]
+    return {"count": 1, "results": results}
+
+
+@test_settings
+class TestSetParts(SimpleTestCase):
+    def test_entries(self):
+        with patch("lego.api_calls._get_response", side_effect=_inventory_stub):
+            entries = list(get_set_parts("123-1"))
+
+        self.assertEqual(
+            [(entry["lego_id"], entry.get("color_name")) for entry in entries],
+            [("fig-0008", None), ("2345", "Red")],
+        )
+
+
+_SET = {"name": "Brick House", "set_img_url": "test://cdn.test/img/123-1.jpg"}
+
+
+@test_settings
+class TestSetInfo(SimpleTestCase):
+    async def test_async_info_same_as_sync(self):
+        with patch("lego.api_calls._get_response", return_value=_SET):
+            info = get_set_info("123-1")
+        with patch("lego.api_calls._aget_response", return_value=_SET) as mock:
+            async_info = await aget_set_info("123-1")
+
+        self.assertEqual(async_info, info)
+
+    async def test_client_shared_until_closed(self):
+        client = _async_client()
+        self.assertIs(_async_client(), client)
+
+        await aclose_async_client()
+        self.assertTrue(client.is_closed)
+        self.assertIsNot(_async_client(), client)
+        await aclose_async_client()
+
+    async def test_invalid_json(self):
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, text="<html>"))
+        async with httpx.AsyncClient(transport=transport) as client:
+            with self.assertRaises(ApiError):
+                await _aget_response("test://api.test/lego/sets/123-1/", client)
+
+
+class TestRateLimiter(SimpleTestCase):
+    def test_calls_spaced_out(self):
+        limiter = RateLimiter(0.05)
+        start = time.monotonic()
+        for _ in range(3):
+            limiter.wait()
+
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+
+
+def _response(status_code, data=None, etag=None):
+    return Mock(
+        status_code=status_code,
+        headers={"ETag": etag} if etag else {},
+        json=Mock(return_value=data),
+    )
+
+
+@test_settings
+class TestResponseCache(SimpleTestCase):
+    url = "test://api.test/lego/sets/123-1/"
+
+    def setUp(self):
+        temp_dir = TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.cache = ResponseCache(temp_dir.name, ttl=3600, max_size=2**20)
+        patcher = patch("lego.api_calls.response_cache", self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_fresh_entry_used_without_request(self):
+        with patch(
+            "lego.api_calls.requests.get",
+            return_value=_response(200, {"name": "Brick House"}),
+        ) as mock:
+            _get_response(self.url)
+            data = _get_response(self.url)
+
+        mock.assert_called_once()
+        self.assertEqual(data, {"name": "Brick House"})
+
+    def test_stale_entry_revalidated(self):
+        self.cache.ttl = 0
+        with patch(
+            "lego.api_calls.requests.get",
+            side_effect=[_response(200, {"name": "Brick House"}, etag='"v1"'), _response(304)],
+        ) as mock:
+            _get_response(self.url)
+            data = _get_response(self.url)
+
+        self.assertEqual(mock.call_args.kwargs["headers"]["If-None-Match"], '"v1"')
+        self.assertEqual(data, {"name": "Brick House"})
+
+    def test_eviction(self):
+        self.cache.max_size = 1000
+        for n in range(20):
+            self.cache.store(f"{self.url}{n}", {"name": "x" * 100})
+
+        self.assertIsNone(self.cache.get(f"{self.url}0"))
+        self.assertIsNotNone(self.cache.get(f"{self.url}19"))
+
+    def test_entry_removed_by_another_process(self):
+        self.cache.max_size = 0
+        removed = self.cache.directory / "removed.json"
+        glob = Path.glob
+        with (
+            patch.object(Path, "glob", lambda path, pattern: [*glob(path, pattern), removed]),
+            patch(
+                "lego.api_calls.requests.get",
+                return_value=_response(200, {"name": "Brick House"}),
+            ),
+        ):
+            data = _get_response(self.url)
+
+        self.assertEqual(data, {"name": "Brick House"})
+
+    def test_store_error_ignored(self):
+        with (
+            patch.object(Path, "write_text", side_effect=PermissionError),
+            patch(
+                "lego.api_calls.requests.get",
+                return_value=_response(200, {"name": "Brick House"}),
+            ),
+        ):
+            data = _get_response(self.url)
+
+        self.assertEqual(data, {"name": "Brick House"})
+        self.assertIsNone(self.cache.get(self.url))
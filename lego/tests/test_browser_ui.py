@@ -13,6 +13,7 @@ from selenium.webdriver.support.wait import WebDriverWait
 from . import (
     TESTS_DIR,
     test_settings,
+    immediate_tasks,
     get_set_info_mock,
     get_set_parts_mock,
     prepare_assets,
@@ -28,6 +29,7 @@ class Locator:
 
 @tag("browser")
 @test_settings
+@immediate_tasks
 class TestBrowserUI(StaticLiveServerTestCase):
     fixtures = ["test_data", "test_user"]
 
@@ -0,0 +1,169 @@
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from lego.caching import (
+    CATALOG_REVISION,
+    bump_image_versions,
+    bump_revision,
+    bump_shape_versions,
+    bump_versions,
+    get_version,
+    with_catalog_revision,
+)
+from lego.models import LegoPart, LegoSet
+from lego.orm_utils import save_set_with_parts
+
+from . import cached_fragments, get_set_parts_mock, test_settings, _API_DATA
+
+
+@cached_fragments    # outermost, to override the dummy cache of test_settings
+@test_settings
+class TestCachedPages(TestCase):
+    fixtures = ["test_data"]
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_set_detail_cached(self):
+        with self.assertNumQueries(3):
+            self.client.get("/lego/set/123-1/")
+        with self.assertNumQueries(2):    # set items not queried
+            response = self.client.get("/lego/set/123-1/")
+
+        self.assertIn("2345 Brick 2 x 4, Red", response.text)
+
+    def test_part_detail_cached(self):
+        self.client.get("/lego/part/2345/1/")
+        with self.assertNumQueries(2):
+            self.client.get("/lego/part/2345/1/")
+
+    def test_set_detail_rendered_after_bump(self):
+        self.client.get("/lego/set/123-1/")
+        bump_versions("set", [1])
+
+        with self.assertNumQueries(3):
+            self.client.get("/lego/set/123-1/")
+
+
+@cached_fragments
+@test_settings
+class TestConditionalGet(TestCase):
+    fixtures = ["test_data", "test_user"]
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_not_modified(self):
+        response = self.client.get("/lego/set/123-1/")
+        etag = response.headers["ETag"]
+
+        with self.assertNumQueries(1):    # updated_at of the set
+            response = self.client.get(
+                "/lego/set/123-1/", headers={"If-None-Match": etag}
+            )
+        self.assertEqual(response.status_code, 304)
+
+    def test_not_modified_since(self):
+        response = self.client.get("/lego/part/2345/1/")
+        last_modified = response.headers["Last-Modified"]
+
+        response = self.client.get(
+            "/lego/part/2345/1/", headers={"If-Modified-Since": last_modified}
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_modified_after_bump(self):
+        response = self.client.get("/lego/set/123-1/")
+        etag = response.headers["ETag"]
+        bump_versions("set", [1])
+
+        response = self.client.get("/lego/set/123-1/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_stable(self):
+        etags = [
+            self.client.get("/lego/set/123-1/").headers["ETag"] for _ in range(2)
+        ]
+
+        self.assertEqual(etags[0], etags[1])
+
+    def test_modified_after_catalog_bump(self):
+        response = self.client.get("/lego/set/123-1/")
+        etag = response.headers["ETag"]
+        bump_revision(CATALOG_REVISION)
+
+        response = self.client.get("/lego/set/123-1/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_differs_by_user(self):
+        response = self.client.get("/lego/set/123-1/")
+        etag = response.headers["ETag"]
+        self.client.login(username="test-user", password="test-password")
+
+        response = self.client.get("/lego/set/123-1/", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_object(self):
+        response = self.client.get("/lego/set/999-1/")
+
+        self.assertEqual(response.status_code, 404)
+
+
+@cached_fragments
+@test_settings
+class TestVersions(TestCase):
+    fixtures = ["test_data"]
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    @staticmethod
+    def _version(model, pk):
+        return get_version(with_catalog_revision(model.objects).get(pk=pk))
+
+    def test_version_stable(self):
+        self.assertEqual(self._version(LegoSet, 1), self._version(LegoSet, 1))
+
+    def test_bumped(self):
+        version = self._version(LegoPart, 1)
+        bump_versions("part", [1])
+
+        self.assertNotEqual(self._version(LegoPart, 1), version)
+
+    def test_catalog_bump_changes_versions(self):
+        version = self._version(LegoPart, 1)
+        self.assertEqual(bump_revision(CATALOG_REVISION), 1)
+
+        self.assertNotEqual(self._version(LegoPart, 1), version)
+
+    def test_image_bumps_sets_of_part(self):
+        versions = [self._version(LegoSet, 1), self._version(LegoSet, 2)]
+        bump_image_versions([5])    # image of part 3, in set 123-1 only
+
+        self.assertNotEqual(self._version(LegoSet, 1), versions[0])
+        self.assertEqual(self._version(LegoSet, 2), versions[1])
+
+    def test_shape_bumps_parts_and_sets(self):
+        part = LegoPart.objects.get(pk=3)
+        versions = [self._version(LegoPart, 3), self._version(LegoSet, 1)]
+        bump_shape_versions([part.shape_id])
+
+        self.assertNotEqual(self._version(LegoPart, 3), versions[0])
+        self.assertNotEqual(self._version(LegoSet, 1), versions[1])
+
+    def test_set_bumped_on_changed_items(self):
+        set_ = LegoSet.objects.create(lego_id="2001-1")
+        version = self._version(LegoSet, set_.pk)
+        with (
+            get_set_parts_mock(),
+            patch("lego.orm_utils.store_set_image"),
+            patch("lego.orm_utils.store_part_images"),
+        ):
+            save_set_with_parts(set_, _API_DATA["2001-1"]["info"])
+
+        self.assertNotEqual(self._version(LegoSet, set_.pk), version)
@@ -0,0 +1,314 @@
+import csv
+import gzip
+import shutil
+from hashlib import sha256
+from io import BytesIO, StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from PIL.Image import new
+
+from lego.images import _content_path
+from lego.models import Color, Image, LegoSet, Revision, SetItem
+
+from . import test_settings
+from .factories import ImageFactory
+
+_SET_INFO = {
+    "name": "Brick House",
+    "image_url": "test://cdn.test/img/123.jpg",
+}
+
+_SET_PARTS = [
+    {
+        "lego_id": "2345",
+        "name": "Brick 2 x 4",
+        "color_name": "Red",
+        "image_url": "test://cdn.test/img/2345R.jpg",
+        "quantity": 1,
+        "is_spare": False,
+    },
+    {
+        "lego_id": "fig-0008",
+        "name": "Man, Brown Hat",
+        "image_url": "test://cdn.test/img/fig-0008.jpg",
+        "quantity": 1,
+    },
+    {
+        "lego_id": "2345pr0001",
+        "name": "Brick 2 x 4 with print",
+        "color_name": "Red",
+        "image_url": "test://cdn.test/img/2345pr0001R.jpg",
+        "quantity": 2,
+        "is_spare": False,
+    },
+    {
+        "lego_id": "23456",
+        "name": "Plate 1 x 3",
+        "color_name": "Red",
+        "image_url": None,
+        "quantity": 1,
+        "is_spare": False,
+    },
+]
+
+
+def _load_set(lego_id, set_parts):
+    stdout = StringIO()
+    with (
+        patch(
+            "lego.management.commands.loadset.get_set_info",
+            return_value=_SET_INFO,
+        ),
+        patch("lego.orm_utils.get_set_parts", return_value=iter(set_parts)),
+        patch("lego.orm_utils.store_part_images"),
+    ):
+        call_command("loadset", lego_id, stdout=stdout)
+    return stdout.getvalue()
+
+
+@test_settings
+class TestLoadSet(TestCase):
+    fixtures = ["test_data"]
+
+    def _set_items(self):
+        return set(
+            LegoSet.objects.get(lego_id="123-1")
+            .setitem_set.values_list("pk", "part__shape__lego_id", "quantity")
+        )
+
+    def test_unchanged_set(self):
+        set_items = self._set_items()
+        output = _load_set("123-1", _SET_PARTS)
+
+        self.assertIn("Set items unchanged", output)
+        self.assertEqual(self._set_items(), set_items)
+
+    def test_catalog_set_added_to_collection(self):
+        LegoSet.objects.filter(lego_id="123-1").update(owned=False)
+        output = _load_set("123-1", _SET_PARTS)
+
+        self.assertIn("Set added to the collection", output)
+        self.assertTrue(LegoSet.objects.get(lego_id="123-1").owned)
+
+    def test_changed_set(self):
+        set_parts = [
+            _SET_PARTS[0] | {"quantity": 3},    # updated
+            *_SET_PARTS[1:3],
+            # 23456 Red deleted
+            _SET_PARTS[3] | {"color_name": "White"},    # created
+        ]
+        set_items = self._set_items()
+        output = _load_set("123-1", set_parts)
+
+        self.assertIn("Set items: 1 created, 1 updated, 1 deleted", output)
+        new_set_items = self._set_items()
+        # items of unchanged parts were kept
+        self.assertEqual(len(set_items & new_set_items), 2)
+        self.assertEqual(
+            {(lego_id, quantity) for _, lego_id, quantity in new_set_items},
+            {("2345", 3), ("fig-0008", 1), ("2345pr0001", 2), ("23456", 1)},
+        )
+
+
+_CATALOG_DUMPS = {
+    "colors": [
+        ("id", "name", "rgb", "is_trans"),
+        ("1", "Blue", "0055BF", "False"),
+        ("4", "Red", "C91A09", "False"),
+        ("15", "White", "FFFFFF", "False"),
+        ("9999", "[No Color/Any Color]", "05131D", "False"),
+    ],
+    "parts": [
+        ("part_num", "name", "part_cat_id", "part_material"),
+        ("2345", "Brick 2 x 4", "11", "Plastic"),
+        ("2345pr0001", "Brick 2 x 4 with print", "11", "Plastic"),
+        ("23456", "Plate 1 x 3", "14", "Plastic"),
+        ("3001", "Brick 2 x 4 Blue Edition", "11", "Plastic"),
+    ],
+    "minifigs": [
+        ("fig_num", "name", "num_parts", "img_url"),
+        ("fig-0008", "Man, Brown Hat", "4", "test://cdn.test/img/fig-0008.jpg"),
+    ],
+    "sets": [
+        ("set_num", "name", "year", "theme_id", "num_parts", "img_url"),
+        ("123-1", "Brick House", "2020", "1", "5", "test://cdn.test/img/123.jpg"),
+        ("4001-1", "Blue Wall", "2021", "1", "4", "test://cdn.test/img/4001.jpg"),
+    ],
+    "inventories": [
+        ("id", "version", "set_num"),
+        ("1", "1", "123-1"),
+        ("2", "1", "4001-1"),
+        ("3", "2", "4001-1"),
+        ("4", "1", "fig-0008"),
+    ],
+    "inventory_parts": [
+        ("inventory_id", "part_num", "color_id", "quantity", "is_spare", "img_url"),
+        ("1", "2345", "4", "1", "False", "test://cdn.test/img/2345R.jpg"),
+        ("1", "2345pr0001", "4", "2", "False", "test://cdn.test/img/2345pr0001R.jpg"),
+        ("1", "23456", "4", "1", "False", ""),
+        ("2", "3001", "1", "5", "False", "test://cdn.test/img/3001B.jpg"),
+        ("3", "3001", "1", "4", "False", "test://cdn.test/img/3001B.jpg"),
+        ("3", "3001", "1", "1", "True", "test://cdn.test/img/3001B.jpg"),
+        ("4", "2345", "15", "1", "False", "test://cdn.test/img/2345W.jpg"),
+    ],
+    "inventory_minifigs": [
+        ("inventory_id", "fig_num", "quantity"),
+        ("1", "fig-0008", "1"),
+    ],
+}
+
+
+@test_settings
+class TestLoadCatalog(TestCase):
+    fixtures = ["test_data"]
+
+    def setUp(self):
+        temp_dir = TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.dump_dir = Path(temp_dir.name)
+        for dump, rows in _CATALOG_DUMPS.items():
+            with gzip.open(self.dump_dir / f"{dump}.csv.gz", "wt", newline="") as file:
+                csv.writer(file).writerows(rows)
+
+    def _load_catalog(self):
+        stdout = StringIO()
+        call_command("loadcatalog", self.dump_dir, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_new_set(self):
+        self._load_catalog()
+
+        new_set = LegoSet.objects.get(lego_id="4001-1")
+        self.assertEqual(new_set.name, "Blue Wall")
+        self.assertEqual(new_set.image.origin_url, "test://cdn.test/img/4001.jpg")
+        # latest inventory version, spare part skipped
+        item = new_set.setitem_set.get()
+        self.assertEqual(item.quantity, 4)
+        self.assertEqual(str(item.part), "3001 Brick 2 x 4 Blue Edition, Blue")
+        self.assertEqual(item.part.image.origin_url, "test://cdn.test/img/3001B.jpg")
+        self.assertEqual(new_set.items_revision, 1)
+        self.assertFalse(new_set.owned)
+
+    def test_existing_set_unchanged(self):
+        set_items = set(
+            SetItem.objects.filter(set__lego_id="123-1")
+            .values_list("pk", "part", "quantity")
+        )
+        self._load_catalog()
+
+        self.assertEqual(
+            set(
+                SetItem.objects.filter(set__lego_id="123-1")
+                .values_list("pk", "part", "quantity")
+            ),
+            set_items,
+        )
+
+    def test_repeated_load(self):
+        self._load_catalog()
+        output = self._load_catalog()
+
+        self.assertIn("Merged created set items: 0", output)
+        self.assertIn("Merged deleted set items: 0", output)
+        self.assertEqual(Color.objects.filter(name="Blue").count(), 1)
+        self.assertEqual(Revision.objects.get(name="catalog").number, 2)
+
+    def test_missing_dump(self):
+        (self.dump_dir / "sets.csv.gz").unlink()
+        with self.assertRaisesMessage(CommandError, "sets.csv.gz"):
+            self._load_catalog()
+
+
+def _png_content():
+    stream = BytesIO()
+    new("RGB", (96, 96), color="#000").save(stream, format="png")
+    return stream.getvalue()
+
+
+@test_settings
+class TestRepairImages(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.subdir = settings.MEDIA_ROOT / "lego"
+        self.addCleanup(shutil.rmtree, self.subdir, ignore_errors=True)
+
+    def _call_command(self, *args):
+        stdout = StringIO()
+        stderr = StringIO()
+        call_command("repairimages", *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_images_repaired(self):
+        not_stored = ImageFactory.create(path=None)
+        file_missing = ImageFactory.create(path="lego/img/missing.webp")
+        with patch("lego.images._download", return_value=_png_content()):
+            stdout, stderr = self._call_command()
+
+        self.assertIn("Repaired 2 of 2 images.", stdout)
+        self.assertEqual(stderr, "")
+        for image in (not_stored, file_missing):
+            image.refresh_from_db()
+            self.assertTrue((settings.MEDIA_ROOT / image.path).is_file())
+
+    def test_stored_image_skipped(self):
+        ImageFactory.create(path=None)
+        with patch("lego.images._download", return_value=_png_content()):
+            self._call_command()
+        with patch("lego.images._download") as mock:
+            stdout, _ = self._call_command()
+
+        mock.assert_not_called()
+        self.assertIn("Repaired 0 of 0 images.", stdout)
+
+    def test_failed_download_reported(self):
+        image = ImageFactory.create(path=None)
+        with patch("lego.images._download", side_effect=OSError):
+            stdout, stderr = self._call_command()
+
+        self.assertIn("Repaired 0 of 1 images.", stdout)
+        self.assertIn(f"Still broken: {image.pk}", stderr)
+
+    def test_shared_file_restored(self):
+        content_hash = sha256(_png_content()).hexdigest()
+        images = ImageFactory.create_batch(
+            2, path=_content_path(content_hash), content_hash=content_hash
+        )
+        with patch("lego.images._download", return_value=_png_content()):
+            stdout, _ = self._call_command("--batch-size", "1")
+
+        self.assertIn(f"resume with --after {images[0].pk}", stdout)
+        self.assertIn("Repaired 1 of 1 images.", stdout)
+        self.assertTrue((settings.MEDIA_ROOT / images[1].path).is_file())
+
+    def test_resumed_after_pk(self):
+        images = ImageFactory.create_batch(2, path=None)
+        with patch("lego.images._download", return_value=_png_content()):
+            stdout, _ = self._call_command("--after", str(images[0].pk))
+
+        self.assertIn("Repaired 1 of 1 images.", stdout)
+        self.assertFalse(
+            Image.objects.filter(pk=images[0].pk, path__isnull=False).exists()
+        )
+
+
+@test_settings
+class TestRebuildAggregates(TestCase):
+    fixtures = ["test_data"]
+
+    def test_aggregates_rebuilt(self):
+        LegoSet.objects.update(num_pieces=0, num_unique_parts=0, num_colors=0)
+        stdout = StringIO()
+        call_command("rebuildaggregates", stdout=stdout)
+
+        self.assertIn("Rebuilt aggregates of 2 sets", stdout.getvalue())
+        self.assertQuerySetEqual(
+            LegoSet.objects.order_by("pk").values_list(
+                "num_pieces", "num_unique_parts", "num_colors"
+            ),
+            [(5, 4, 1), (3, 3, 2)],
+        )
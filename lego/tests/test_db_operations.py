@@ -1,5 +1,13 @@
+from unittest.mock import patch
+
+import psycopg
+from django.db import OperationalError, connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
+from lego.models import LegoSet
+from lego import orm_utils
+from lego.orm_utils import save_set_with_parts
 from lego.tests import test_settings
 
 
@@ -8,29 +16,27 @@ class TestNumberOfQueries(TestCase):
     fixtures = ["test_data"]
 
     def test_index_page(self):
-        with self.assertNumQueries(2):
+        with self.assertNumQueries(1):    # keyset pagination, no COUNT query
             self.client.get("/lego/")
 
     def test_set_detail(self):
         """
-        1. select LegoSet + related many-to-one (select_related)
-        2. select SetItem (many-to-many) rows related to 1. (prefetch_related)
-        3. select LegoPart rows related to 2.
-        4. select Shape rows related to 3.
-        5. select Color rows related to 3.
-        6. select Image rows related to 3.
+        1. select updated_at of LegoSet (conditional GET)
+        2. select LegoSet + related many-to-one (select_related)
+        3. select SetItem rows related to 2. + their parts with shapes, colors
+           and images (select_related)
         """
-        with self.assertNumQueries(6):
+        with self.assertNumQueries(3):
             self.client.get("/lego/set/123-1/")
 
     def test_part_detail(self):
         """
-        1. select LegoPart + related many-to-one (select_related)
-        2. select SetItem (many-to-many) rows related to 1. (prefetch_related)
-        3. select LegoSet rows related to 2.
-        4. select Image rows related to 3.
+        1. select updated_at of LegoPart (conditional GET)
+        2. select LegoPart + related many-to-one (select_related)
+        3. select SetItem rows related to 2. + their sets with images
+           (select_related)
         """
-        with self.assertNumQueries(4):
+        with self.assertNumQueries(3):
             self.client.get("/lego/part/2345/1/")
 
     def test_search_in_all_mode(self):
@@ -56,3 +62,95 @@ class TestNumberOfQueries(TestCase):
             self.client.get(
                 "/lego/search/", query_params={"q": "red", "mode": "color"}
             )
+
+    def test_autocomplete(self):
+        with self.assertNumQueries(2):    # 1 LegoSet query + 1 LegoPart query
+            self.client.get("/lego/search/autocomplete/", query_params={"q": "brick"})
+
+    def test_compare(self):
+        """
+        1. select LegoSet rows by lego_id
+        2. select SetItem rows of all compared sets
+        3. select LegoPart rows found in the comparison + their shapes, colors
+           and images (select_related)
+        """
+        with self.assertNumQueries(3):
+            self.client.get(
+                "/lego/compare/json/", query_params={"sets": "123-1 111-1"}
+            )
+
+
+@test_settings
+class TestSaveSetWithParts(TestCase):
+    @staticmethod
+    def _parts_stub(num_parts):
+        def stub(set_lego_id):
+            for n in range(num_parts):
+                yield {
+                    "lego_id": f"{set_lego_id}-{n}",
+                    "name": f"Test Shape {n}",
+                    "color_name": f"Test Color {n}",
+                    "image_url": f"test://cdn.test/img/{set_lego_id}-{n}.jpg",
+                    "quantity": 1,
+                    "is_spare": False,
+                }
+
+        return stub
+
+    def _count_queries(self, lego_id, num_parts):
+        set_ = LegoSet.objects.create(lego_id=lego_id)
+        set_info = {"name": "Test Set", "image_url": None}
+        with (
+            patch("lego.orm_utils.get_set_parts", side_effect=self._parts_stub(num_parts)),
+            patch("lego.orm_utils.store_part_images"),
+            CaptureQueriesContext(connection) as context,
+        ):
+            save_set_with_parts(set_, set_info)
+
+        self.assertEqual(set_.setitem_set.count(), num_parts)
+        return len(context.captured_queries)
+
+    def test_number_of_queries_independent_of_number_of_parts(self):
+        self.assertEqual(
+            self._count_queries("3001-1", 5),
+            self._count_queries("3002-1", 50),
+        )
+
+    def test_aggregates_updated(self):
+        set_ = LegoSet.objects.create(lego_id="3003-1")
+        set_info = {"name": "Test Set", "image_url": None}
+        with (
+            patch("lego.orm_utils.get_set_parts", side_effect=self._parts_stub(3)),
+            patch("lego.orm_utils.store_part_images"),
+        ):
+            save_set_with_parts(set_, set_info)
+
+        set_.refresh_from_db()
+        self.assertEqual(
+            (set_.num_pieces, set_.num_unique_parts, set_.num_colors), (3, 3, 3)
+        )
+        self.assertEqual(set_.items_revision, 1)
+
+    def test_retried_after_deadlock(self):
+        set_ = LegoSet.objects.create(lego_id="3004-1")
+        set_info = {"name": "Test Set", "image_url": None}
+        update_set_items = orm_utils._update_set_items
+        attempts = []
+
+        def deadlock_once(*args):
+            attempts.append(args)
+            if len(attempts) == 1:
+                raise OperationalError("deadlock detected") from (
+                    psycopg.errors.DeadlockDetected()
+                )
+            return update_set_items(*args)
+
+        with (
+            patch("lego.orm_utils.get_set_parts", side_effect=self._parts_stub(3)),
+            patch("lego.orm_utils.store_part_images"),
+            patch("lego.orm_utils._update_set_items", side_effect=deadlock_once),
+        ):
+            save_set_with_parts(set_, set_info)
+
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(set_.setitem_set.count(), 3)
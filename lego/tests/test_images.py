@@ -1,15 +1,30 @@
 import shutil
-from unittest.mock import patch, create_autospec
+from hashlib import sha256
+from io import BytesIO
+from unittest.mock import MagicMock, patch, create_autospec
 
 from django.conf import settings
+from django.template import Context, Template
 from django.test import TestCase
-from PIL.Image import Image, new
+from PIL.Image import Image, new, open as open_image
+from requests import ConnectionError, HTTPError
 
-from lego.images import _scale_down, _save_to_media, _store_image
-from lego.models import LegoPart
+from lego.images import (
+    _content_path,
+    _build_sprite_sheet,
+    _download,
+    _process_image,
+    _scale_down,
+    _save_to_media,
+    _store_image,
+    _store_images,
+    _try_download,
+    variant_path,
+)
+from lego.models import Image as ImageModel, LegoPart, LegoSet
 
 from . import test_settings
-from .factories import LegoPartFactory
+from .factories import LegoPartFactory, LegoSetFactory, SetItemFactory
 
 
 @test_settings
@@ -18,13 +33,96 @@ class TestScaleDown(TestCase):
         img = create_autospec(Image, instance=True, width=768, height=384)
         _scale_down(img)
 
-        img.resize.assert_called_once_with((384, 192))
+        img.thumbnail.assert_called_once()
+        self.assertEqual(img.thumbnail.call_args.args, ((384, 384),))
 
     def test_small_image_not_resized(self):
         img = create_autospec(Image, instance=True, width=384, height=384)
         _scale_down(img)
 
-        img.resize.assert_not_called()
+        img.thumbnail.assert_not_called()
+
+    def test_large_image_size(self):
+        img = new("RGB", (768, 384), color="#000")
+        scaled_img = _scale_down(img)
+
+        self.assertEqual(scaled_img.size, (384, 192))
+
+
+def _streamed_response(content, content_length=None):
+    response = MagicMock()
+    response.__enter__.return_value = response
+    response.headers = (
+        {"Content-Length": str(content_length)} if content_length else {}
+    )
+    response.iter_content.return_value = (
+        content[start:start + 1000] for start in range(0, len(content), 1000)
+    )
+    return response
+
+
+@test_settings
+class TestDownloadImage(TestCase):
+    def test_image_downloaded(self):
+        stream = BytesIO()
+        new("RGB", (96, 96), color="#000").save(stream, format="png")
+        with patch(
+            "lego.images.requests.get",
+            return_value=_streamed_response(stream.getvalue()),
+        ):
+            content = _download("test://cdn.test/img/1.png")
+
+        self.assertEqual(content, stream.getvalue())
+
+    def test_size_limit(self):
+        with (
+            patch("lego.images.MAX_DOWNLOAD_SIZE", 5000),
+            patch(
+                "lego.images.requests.get",
+                return_value=_streamed_response(b"x" * 10_000),
+            ),
+            self.assertRaises(OSError),
+        ):
+            _download("test://cdn.test/img/1.png")
+
+    def test_size_limit_by_content_length(self):
+        response = _streamed_response(b"", content_length=10_000)
+        with (
+            patch("lego.images.MAX_DOWNLOAD_SIZE", 5000),
+            patch("lego.images.requests.get", return_value=response),
+            self.assertRaises(OSError),
+        ):
+            _download("test://cdn.test/img/1.png")
+
+        response.iter_content.assert_not_called()
+
+
+@test_settings
+@patch("lego.images.RETRY_BACKOFF", 0)
+class TestTryDownload(TestCase):
+    def test_transient_error_retried(self):
+        with patch(
+            "lego.images._download", side_effect=[ConnectionError, b"content"]
+        ) as mock:
+            content = _try_download("test://cdn.test/img/1.png", None, retries=1)
+
+        self.assertEqual(content, b"content")
+        self.assertEqual(mock.call_count, 2)
+
+    def test_retries_exhausted(self):
+        with patch("lego.images._download", side_effect=ConnectionError) as mock:
+            content = _try_download("test://cdn.test/img/1.png", None, retries=2)
+
+        self.assertIsNone(content)
+        self.assertEqual(mock.call_count, 3)
+
+    def test_client_error_not_retried(self):
+        error = HTTPError(response=MagicMock(status_code=404))
+        with patch("lego.images._download", side_effect=error) as mock:
+            content = _try_download("test://cdn.test/img/1.png", None, retries=2)
+
+        self.assertIsNone(content)
+        mock.assert_called_once()
 
 
 @test_settings
@@ -36,25 +134,34 @@ class TestSaveToMedia(TestCase):
         self.addCleanup(shutil.rmtree, self.subdir)
 
     def test_image_saved(self):
-        img = new("RGBA", (192, 192), color="#000")
         rel_path = "lego/img/test0099.webp"
-        _save_to_media(img, rel_path)
+        _save_to_media(b"content", rel_path)
 
         self.assertTrue((self.subdir / "img" / "test0099.webp").is_file())
 
+    def test_existing_file_kept(self):
+        rel_path = "lego/img/test0099.webp"
+        _save_to_media(b"content", rel_path)
+        stored_path = _save_to_media(b"other content", rel_path)
+
+        self.assertEqual(stored_path, rel_path)
+        self.assertEqual(
+            (self.subdir / "img" / "test0099.webp").read_bytes(), b"content"
+        )
+
 
 @test_settings
 class TestStoreImage(TestCase):
     @classmethod
     def setUpTestData(cls):
-        LegoPartFactory.create()
+        LegoPartFactory.create(image__path=None)
         LegoPartFactory.create(image__origin_url=None)
         LegoPartFactory.create(image=None)
 
     def test_skips_object_without_image(self):
         pk = LegoPart.objects.filter(image__isnull=True).first().pk
-        with patch("lego.images._download_image") as mock:
-            _store_image(LegoPart, pk, "parts")
+        with patch("lego.images._download") as mock:
+            _store_image(LegoPart, pk)
 
         mock.assert_not_called()
 
@@ -62,18 +169,251 @@ class TestStoreImage(TestCase):
         pk = LegoPart.objects.filter(
             image__isnull=False, image__origin_url__isnull=True
         ).first().pk
-        with patch("lego.images._download_image") as mock:
-            _store_image(LegoPart, pk, "parts")
+        with patch("lego.images._download") as mock:
+            _store_image(LegoPart, pk)
 
         mock.assert_not_called()
 
     def test_skips_invalid_image_url(self):
-        pk = LegoPart.objects.filter(image__origin_url__isnull=False).first().pk
+        pk = LegoPart.objects.filter(
+            image__isnull=False, image__path__isnull=True
+        ).first().pk
         with (
-            patch("lego.images._download_image", side_effect=OSError) as mock_1,
+            patch("lego.images._download", side_effect=OSError) as mock_1,
             patch("lego.images._scale_down") as mock_2,
         ):
-            _store_image(LegoPart, pk, "parts")
+            _store_image(LegoPart, pk)
 
         mock_1.assert_called()
         mock_2.assert_not_called()
+
+    def test_skips_stored_image(self):
+        pk = LegoPart.objects.filter(image__path__isnull=False).first().pk
+        with patch("lego.images._download") as mock:
+            _store_image(LegoPart, pk)
+
+        mock.assert_not_called()
+
+
+def _png_content(size, color="#000"):
+    stream = BytesIO()
+    new("RGB", size, color=color).save(stream, format="png")
+    return stream.getvalue()
+
+
+def _download_stub(contents):
+    """Return a stub of `_download` answering with the content of each URL
+    in `contents`, in whichever order the download threads call it.
+    """
+    return lambda url, session=None: contents[url]
+
+
+@test_settings
+class TestStoreImages(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.subdir = settings.MEDIA_ROOT / "lego"
+        self.addCleanup(shutil.rmtree, self.subdir, ignore_errors=True)
+
+    def test_images_stored(self):
+        parts = LegoPartFactory.create_batch(3, image__path=None)
+        contents = [_png_content((768, 384 + i)) for i in range(3)]
+        stub = _download_stub(
+            {part.image.origin_url: content for part, content in zip(parts, contents)}
+        )
+        with patch("lego.images._download", side_effect=stub):
+            _store_images(LegoPart, [part.pk for part in parts])
+
+        for part, content in zip(parts, contents):
+            part.image.refresh_from_db()
+            self.assertEqual(part.image.content_hash, sha256(content).hexdigest())
+            self.assertEqual(part.image.path, _content_path(part.image.content_hash))
+            with open_image(settings.MEDIA_ROOT / part.image.path) as img:
+                self.assertEqual(img.width, 384)
+
+    def test_variants_stored(self):
+        part = LegoPartFactory.create(image__path=None)
+        with patch("lego.images._download", return_value=_png_content((768, 384))):
+            _store_images(LegoPart, [part.pk])
+
+        part.image.refresh_from_db()
+        self.assertEqual((part.image.width, part.image.height), (384, 192))
+        self.assertTrue(part.image.placeholder.startswith("data:image/webp;base64,"))
+        for size, expected_size in ((96, (96, 48)), (192, (192, 96))):
+            path = variant_path(part.image.path, size)
+            with open_image(settings.MEDIA_ROOT / path) as img:
+                self.assertEqual(img.size, expected_size)
+
+    def test_identical_content_shared(self):
+        parts = LegoPartFactory.create_batch(2, image__path=None)
+        with (
+            patch("lego.images._download", return_value=_png_content((96, 96))),
+            patch("lego.images._process_image", wraps=_process_image) as mock,
+        ):
+            _store_images(LegoPart, [part.pk for part in parts])
+
+        mock.assert_called_once()
+        for part in parts:
+            part.image.refresh_from_db()
+        self.assertIsNotNone(parts[0].image.path)
+        self.assertEqual(parts[0].image.path, parts[1].image.path)
+
+    def test_stored_content_reused(self):
+        part_1 = LegoPartFactory.create(image__path=None)
+        part_2 = LegoPartFactory.create(image__path=None)
+        with patch("lego.images._download", return_value=_png_content((96, 96))):
+            _store_images(LegoPart, [part_1.pk])
+            with patch("lego.images._process_image") as mock:
+                _store_images(LegoPart, [part_2.pk])
+
+        mock.assert_not_called()
+        part_1.image.refresh_from_db()
+        part_2.image.refresh_from_db()
+        self.assertEqual(part_2.image.path, part_1.image.path)
+
+    def test_invalid_image_skipped(self):
+        part = LegoPartFactory.create(image__path=None)
+        with patch("lego.images._download", return_value=b"not an image"):
+            _store_images(LegoPart, [part.pk])
+
+        part.image.refresh_from_db()
+        self.assertIsNone(part.image.path)
+
+    def test_decompression_bomb_skipped(self):
+        bomb, part = LegoPartFactory.create_batch(2, image__path=None)
+        stub = _download_stub({
+            bomb.image.origin_url: _png_content((768, 384)),
+            part.image.origin_url: _png_content((96, 96)),
+        })
+        with (
+            patch("lego.images._download", side_effect=stub),
+            patch("PIL.Image.MAX_IMAGE_PIXELS", 96 * 96),
+        ):
+            _store_images(LegoPart, [bomb.pk, part.pk])
+
+        bomb.image.refresh_from_db()
+        part.image.refresh_from_db()
+        self.assertIsNone(bomb.image.path)
+        self.assertIsNotNone(part.image.path)
+
+    def test_failed_download_skipped(self):
+        part = LegoPartFactory.create(image__path=None)
+        with patch("lego.images._download", side_effect=OSError):
+            _store_images(LegoPart, [part.pk])
+
+        part.image.refresh_from_db()
+        self.assertIsNone(part.image.path)
+
+
+@test_settings
+class TestResponsiveImage(TestCase):
+    def _render(self, image, size=192):
+        template = Template(
+            "{% load lego_extras %}{% responsive_image image size %}"
+        )
+        return template.render(Context({"image": image, "size": size}))
+
+    def test_image_without_variants(self):
+        image = ImageModel(path="lego/img/test0001.webp")
+        html = self._render(image)
+
+        self.assertHTMLEqual(
+            html, '<img src="/media/lego/img/test0001.webp" loading="lazy">'
+        )
+
+    def test_srcset(self):
+        image = ImageModel(path="lego/img/ab/abc.webp", width=384, height=192)
+        html = self._render(image, 96)
+
+        self.assertHTMLEqual(
+            html,
+            '<img src="/media/lego/img/ab/abc.webp" loading="lazy"'
+            ' srcset="/media/lego/img/ab/abc-96.webp 96w,'
+            ' /media/lego/img/ab/abc-192.webp 192w,'
+            ' /media/lego/img/ab/abc.webp 384w"'
+            ' sizes="96px" width="96" height="48">',
+        )
+
+    def test_placeholder(self):
+        image = ImageModel(
+            path="lego/img/ab/abc.webp",
+            width=96,
+            height=96,
+            placeholder="data:image/webp;base64,AAAA",
+        )
+        html = self._render(image)
+
+        self.assertIn('class="placeholder"', html)
+        self.assertIn(
+            'style="--placeholder: url(data:image/webp;base64,AAAA)"', html
+        )
+
+    def test_avif_source(self):
+        image = ImageModel(
+            path="lego/img/ab/abc.webp", width=96, height=96, has_avif=True
+        )
+        html = self._render(image)
+
+        self.assertInHTML(
+            '<source type="image/avif" srcset="/media/lego/img/ab/abc.avif 96w"'
+            ' sizes="96px">',
+            html,
+        )
+
+
+@test_settings
+class TestSpriteSheet(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.subdir = settings.MEDIA_ROOT / "lego"
+        self.addCleanup(shutil.rmtree, self.subdir, ignore_errors=True)
+
+    def test_sheet_built(self):
+        set_ = LegoSetFactory.create()
+        parts = [
+            SetItemFactory.create(set=set_, part__image__path=None).part
+            for _ in range(3)
+        ]
+        contents = [
+            _png_content((768, 384), color) for color in ("#000", "#888", "#fff")
+        ]
+        stub = _download_stub(
+            {part.image.origin_url: content for part, content in zip(parts, contents)}
+        )
+        with patch("lego.images._download", side_effect=stub):
+            _store_images(LegoPart, [part.pk for part in parts])
+        _build_sprite_sheet(set_.pk)
+
+        set_.refresh_from_db()
+        self.assertEqual(
+            set_.sprite_offsets,
+            {
+                str(parts[0].pk): [0, 0, 192, 96],
+                str(parts[1].pk): [192, 0, 192, 96],
+                str(parts[2].pk): [0, 192, 192, 96],
+            },
+        )
+        with open_image(settings.MEDIA_ROOT / set_.sprite_path) as img:
+            self.assertEqual(img.size, (384, 384))
+
+    def test_set_without_part_images(self):
+        set_ = LegoSetFactory.create()
+        SetItemFactory.create(set=set_, part__image=None)
+        _build_sprite_sheet(set_.pk)
+
+        set_.refresh_from_db()
+        self.assertIsNone(set_.sprite_path)
+
+    def test_sprite_image_tag(self):
+        part = LegoPartFactory.create()
+        legoset = LegoSet(
+            sprite_path="lego/img/sprites/1.webp",
+            sprite_offsets={str(part.pk): [192, 0, 192, 96]},
+        )
+        template = Template(
+            "{% load lego_extras %}{% sprite_image legoset part %}"
+        )
+        html = template.render(Context({"legoset": legoset, "part": part}))
+
+        self.assertIn("background-position: -192px 0px", html)
+        self.assertIn("width: 192px; height: 96px", html)
@@ -5,12 +5,19 @@ from django.test import TestCase, tag
 from lego.images import _store_image
 from lego.models import LegoPart
 
-from . import test_settings, OrderedPartsMixin, get_set_info_mock, get_set_parts_mock
+from . import (
+    test_settings,
+    immediate_tasks,
+    OrderedPartsMixin,
+    get_set_info_mock,
+    get_set_parts_mock,
+)
 from .factories import LegoPartFactory
 
 
 @tag("login")
 @test_settings
+@immediate_tasks
 class TestAddSet(TestCase, OrderedPartsMixin):
     fixtures = ["test_data", "test_user"]
 
@@ -124,14 +131,14 @@ class TestAddSet(TestCase, OrderedPartsMixin):
 class TestStoreImage(TestCase, OrderedPartsMixin):
     @classmethod
     def setUpTestData(cls):
-        LegoPartFactory.create()
+        LegoPartFactory.create(image__path=None)
         LegoPartFactory.create(image__origin_url=None)
         LegoPartFactory.create(image=None)
 
     def test_object_without_image(self):
         pk = LegoPart.objects.filter(image__isnull=True).first().pk
         with self.assertLogs("lego.images", "INFO") as log_obj:
-            _store_image(LegoPart, pk, "parts")
+            _store_image(LegoPart, pk)
 
         log_output = "\n".join(log_obj.output)
         self.assertParts(log_output, "INFO", "No image: LegoPart")
@@ -141,18 +148,20 @@ class TestStoreImage(TestCase, OrderedPartsMixin):
             image__isnull=False, image__origin_url__isnull=True
         ).first().pk
         with self.assertLogs("lego.images", "INFO") as log_obj:
-            _store_image(LegoPart, pk, "parts")
+            _store_image(LegoPart, pk)
 
         log_output = "\n".join(log_obj.output)
         self.assertParts(log_output, "INFO", "No image URL: Image")
 
     def test_invalid_image_url(self):
-        pk = LegoPart.objects.filter(image__origin_url__isnull=False).first().pk
+        pk = LegoPart.objects.filter(
+            image__isnull=False, image__path__isnull=True
+        ).first().pk
         with (
-            patch("lego.images._download_image", side_effect=OSError),
+            patch("lego.images._download", side_effect=OSError),
             self.assertLogs("lego.images", "ERROR") as log_obj,
         ):
-            _store_image(LegoPart, pk, "parts")
+            _store_image(LegoPart, pk)
 
         log_output = "\n".join(log_obj.output)
         self.assertParts(log_output, "ERROR", "reading image URL for LegoPart")
@@ -2,7 +2,7 @@ from django.test import TestCase, tag
 
 from lego.models import Shape, Color, Image, LegoPart, LegoSet
 
-from . import test_settings, get_set_info_mock, get_set_parts_mock
+from . import test_settings, immediate_tasks, get_set_info_mock, get_set_parts_mock
 
 
 @test_settings
@@ -15,6 +15,7 @@ class TestGeneratedField(TestCase):
 
 @tag("login", "write-db")
 @test_settings
+@immediate_tasks
 class TestAddSet(TestCase):
     fixtures = ["test_data", "test_user"]
 
@@ -1,15 +1,21 @@
 import shutil
 from operator import attrgetter
+from unittest.mock import patch
 
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase, tag
 
+from lego.orm_utils import refresh_inventory
+
 from . import (
     test_settings,
+    immediate_tasks,
     OrderedPartsMixin,
     get_set_info_mock,
     get_set_parts_mock,
     prepare_assets,
 )
+from .factories import LegoPartFactory, LegoSetFactory
 
 
 @test_settings
@@ -58,6 +64,7 @@ class TestResponseContent(TestCase, OrderedPartsMixin):
             "111-1 Airport",
         )
         self.assertParts(response.text, "123-1 Brick House")
+        self.assertParts(response.text, "111-1 Airport", "3 pieces")
 
     def test_set_detail(self):
         response = self.client.get("/lego/set/123-1/")
@@ -73,6 +80,16 @@ class TestResponseContent(TestCase, OrderedPartsMixin):
             response.text, "2x", "2345pr0001 Brick 2 x 4 with print, Red",
         )
 
+    def test_set_detail_aggregates(self):
+        response = self.client.get("/lego/set/123-1/")
+
+        self.assertParts(
+            response.text,
+            "5 pieces, 4 unique parts",
+            "1 colors",
+            "Contains:",
+        )
+
     def test_part_detail(self):
         response = self.client.get("/lego/part/fig-0008/")
 
@@ -111,6 +128,32 @@ class TestResponseQuerySet(TestCase):
             ordered=False,
         )
 
+    def test_index_page_after_pk(self):
+        sets = LegoSetFactory.create_batch(30)
+        response = self.client.get("/lego/")
+        page = response.context["page"]
+        self.assertEqual(list(page), sets[:-25:-1])
+        self.assertEqual(page.next_after, sets[-24].pk)
+
+        response = self.client.get("/lego/", query_params={"after": page.next_after})
+        page = response.context["page"]
+        self.assertEqual(
+            [set_.lego_id for set_ in page][-2:], ["111-1", "123-1"]
+        )
+        self.assertEqual(len(page), 8)
+        self.assertFalse(page.has_next())
+
+    def test_index_page_partial(self):
+        response = self.client.get("/lego/", query_params={"partial": 1})
+
+        self.assertNotIn("<html", response.text)
+        self.assertIn("123-1 Brick House", response.text)
+
+    def test_index_page_invalid_after(self):
+        response = self.client.get("/lego/", query_params={"after": "x"})
+
+        self.assertEqual(response.status_code, 404)
+
     def test_set_and_parts_found_by_name(self):
         response = self.client.get(
             "/lego/search/", query_params={"q": "brick", "mode": "name"}
@@ -128,6 +171,62 @@ class TestResponseQuerySet(TestCase):
             ordered=False,
         )
 
+    def test_parts_ordered_by_relevance(self):
+        part = LegoPartFactory.create(shape__name="Bricklayer Minifig")
+        response = self.client.get(
+            "/lego/search/", query_params={"q": "brick", "mode": "name"}
+        )
+
+        parts = list(response.context["parts"])
+        self.assertEqual(len(parts), 4)
+        self.assertEqual(parts[-1], part)
+
+    def test_parts_paginated(self):
+        LegoPartFactory.create_batch(30, shape__name="Brick 1 x 1")
+        response = self.client.get(
+            "/lego/search/", query_params={"q": "brick", "mode": "name"}
+        )
+        self.assertEqual(len(response.context["parts"]), 24)
+        self.assertTrue(response.context["parts"].has_next())
+        self.assertFalse(response.context["sets"].has_next())
+
+        response = self.client.get(
+            "/lego/search/",
+            query_params={"q": "brick", "mode": "name", "parts_page": 2},
+        )
+        self.assertEqual(len(response.context["parts"]), 9)
+        self.assertFalse(response.context["parts"].has_next())
+        self.assertEqual(len(response.context["sets"]), 1)
+
+    @patch("lego.views.MAX_SEARCH_RESULTS", 30)
+    def test_results_capped(self):
+        LegoPartFactory.create_batch(30, shape__name="Brick 1 x 1")
+        response = self.client.get(
+            "/lego/search/",
+            query_params={"q": "brick", "mode": "name", "parts_page": 2},
+        )
+
+        self.assertEqual(len(response.context["parts"]), 6)
+        self.assertFalse(response.context["parts"].has_next())
+
+    @patch("lego.views.MAX_SEARCH_RESULTS", 30)
+    def test_best_matches_beyond_cap_found(self):
+        LegoPartFactory.create_batch(40, shape__name="Bricklayer Minifig")
+        part = LegoPartFactory.create(shape__name="Brick 1 x 1")
+        response = self.client.get(
+            "/lego/search/", query_params={"q": "brick", "mode": "name"}
+        )
+
+        self.assertIn(part, list(response.context["parts"])[:4])
+
+    def test_invalid_page_number(self):
+        response = self.client.get(
+            "/lego/search/",
+            query_params={"q": "brick", "mode": "name", "parts_page": "x"},
+        )
+
+        self.assertEqual(response.context["parts"].number, 1)
+
     def test_set_found_by_lego_id(self):
         response = self.client.get(
             "/lego/search/", query_params={"q": "123", "mode": "id"}
@@ -287,6 +386,245 @@ class TestSearch(TestCase, OrderedPartsMixin):
         self.assertIn("Nothing Found", response.text)
 
 
+@test_settings
+class TestAutocomplete(TestCase):
+    fixtures = ["test_data"]
+
+    def test_sets_and_parts_by_name(self):
+        response = self.client.get(
+            "/lego/search/autocomplete/", query_params={"q": "bri"}
+        )
+
+        data = response.json()
+        self.assertEqual(
+            data["sets"],
+            [{"lego_id": "123-1", "name": "Brick House", "url": "/lego/set/123-1/"}],
+        )
+        self.assertEqual(
+            [(part["lego_id"], part["color"]) for part in data["parts"]],
+            [("2345", "Red"), ("2345", "White"), ("2345pr0001", "Red")],
+        )
+
+    def test_parts_by_lego_id(self):
+        response = self.client.get(
+            "/lego/search/autocomplete/", query_params={"q": "2345p"}
+        )
+
+        data = response.json()
+        self.assertEqual(data["sets"], [])
+        self.assertEqual(
+            [(part["lego_id"], part["url"]) for part in data["parts"]],
+            [("2345pr0001", "/lego/part/2345pr0001/1/")],
+        )
+
+    def test_new_rows_found(self):
+        LegoPartFactory.create(shape__lego_id="98765", shape__name="Tile 1 x 1")
+        response = self.client.get(
+            "/lego/search/autocomplete/", query_params={"q": "987"}
+        )
+
+        self.assertEqual(response.json()["parts"][0]["lego_id"], "98765")
+
+    def test_empty_prefix(self):
+        response = self.client.get("/lego/search/autocomplete/")
+
+        self.assertEqual(response.json(), {"sets": [], "parts": []})
+
+    def test_short_prefix(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                "/lego/search/autocomplete/", query_params={"q": "23"}
+            )
+
+        self.assertEqual(response.json(), {"sets": [], "parts": []})
+
+
+@test_settings
+class TestInventory(TestCase, OrderedPartsMixin):
+    fixtures = ["test_data"]
+
+    def setUp(self):
+        refresh_inventory.call()
+
+    def _lego_ids(self, **params):
+        response = self.client.get("/lego/inventory/json/", query_params=params)
+        return [(item["lego_id"], item["color"]) for item in response.json()["items"]]
+
+    def test_inventory_page(self):
+        response = self.client.get("/lego/inventory/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertParts(
+            response.text,
+            "/lego/part/2345/1/", "2x", "in 2 sets",
+            "/lego/part/2345pr0001/1/", "2x", "in 1 set",
+        )
+
+    def test_sorted_by_quantity(self):
+        self.assertEqual(
+            self._lego_ids(),
+            [
+                ("2345", "Red"),
+                ("2345pr0001", "Red"),
+                ("2345", "White"),
+                ("fig-0008", None),
+                ("23456", "White"),
+                ("23456", "Red"),
+            ],
+        )
+
+    def test_sorted_by_lego_id(self):
+        self.assertEqual(
+            self._lego_ids(sort="part"),
+            [
+                ("2345", "Red"),
+                ("2345", "White"),
+                ("23456", "Red"),
+                ("23456", "White"),
+                ("2345pr0001", "Red"),
+                ("fig-0008", None),
+            ],
+        )
+
+    def test_filtered_by_color(self):
+        self.assertEqual(
+            self._lego_ids(color=1),
+            [("2345", "Red"), ("2345pr0001", "Red"), ("23456", "Red")],
+        )
+
+    def test_invalid_color(self):
+        response = self.client.get(
+            "/lego/inventory/json/", query_params={"color": 999}
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_pagination(self):
+        with patch("lego.views.INVENTORY_PAGE_SIZE", 4):
+            response = self.client.get(
+                "/lego/inventory/json/", query_params={"page": 2}
+            )
+
+        data = response.json()
+        self.assertEqual(len(data["items"]), 2)
+        self.assertEqual(data["page"], 2)
+        self.assertFalse(data["has_next"])
+
+
+@test_settings
+class TestBuildable(TestCase, OrderedPartsMixin):
+    fixtures = ["test_data"]
+
+    def setUp(self):
+        self.enterContext(patch("lego.vectors._cache", None))
+
+    def test_collection(self):
+        refresh_inventory.call()
+
+        response = self.client.get("/lego/buildable/")
+
+        self.assertParts(
+            response.text,
+            "111-1 Airport", "33% buildable",
+            "123-1 Brick House", "20% buildable",
+        )
+
+    def test_parts_list(self):
+        parts_list = SimpleUploadedFile(
+            "parts.csv", b"lego_id,color,quantity\n2345,Red,2\nfig-0008,,1\n"
+        )
+
+        response = self.client.post(
+            "/lego/buildable/",
+            data={"parts_list": parts_list, "color_agnostic": "on"},
+        )
+
+        self.assertParts(
+            response.text,
+            "111-1 Airport", "67% buildable",
+            "123-1 Brick House", "40% buildable",
+        )
+
+    def test_invalid_parts_list(self):
+        parts_list = SimpleUploadedFile(
+            "parts.csv", b"lego_id,color,quantity\n2345,Red,many\n"
+        )
+
+        response = self.client.post("/lego/buildable/", data={"parts_list": parts_list})
+
+        self.assertIn("Invalid line 2 of the parts list.", response.text)
+
+
+@test_settings
+class TestCompare(TestCase, OrderedPartsMixin):
+    fixtures = ["test_data"]
+
+    def test_compare_page(self):
+        response = self.client.get(
+            "/lego/compare/", query_params={"sets": "123 111"}
+        )
+
+        self.assertParts(
+            response.text,
+            "123-1 Brick House", "100%", "14%",
+            "111-1 Airport", "14%", "100%",
+            "In all sets:", "1x", "2345 Brick 2 x 4, Red",
+            "More in 123-1 Brick House:",
+            "1x", "23456 Plate 1 x 3, Red",
+            "2x", "2345pr0001 Brick 2 x 4 with print, Red",
+            "1x", "fig-0008 Man, Brown Hat",
+            "More in 111-1 Airport:",
+            "1x", "2345 Brick 2 x 4, White",
+            "1x", "23456 Plate 1 x 3, White",
+        )
+
+    def test_compare_json(self):
+        response = self.client.get(
+            "/lego/compare/json/", query_params={"sets": "111-1,123-1"}
+        )
+
+        data = response.json()
+        self.assertEqual(
+            [set_["lego_id"] for set_ in data["sets"]], ["111-1", "123-1"]
+        )
+        self.assertEqual(
+            data["intersection"],
+            [
+                {
+                    "lego_id": "2345",
+                    "name": "Brick 2 x 4",
+                    "color": "Red",
+                    "url": "/lego/part/2345/1/",
+                    "quantity": 1,
+                },
+            ],
+        )
+        self.assertEqual(
+            [
+                (part["lego_id"], part["quantity"])
+                for part in data["differences"]["123-1"]
+            ],
+            [("23456", 1), ("2345pr0001", 2), ("fig-0008", 1)],
+        )
+        self.assertAlmostEqual(data["jaccard"][0][1], 1 / 7)
+
+    def test_unknown_set(self):
+        response = self.client.get(
+            "/lego/compare/json/", query_params={"sets": "123-1 999-1"}
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()["errors"]["sets"][0]["message"], "Sets not found: 999-1"
+        )
+
+    def test_single_set(self):
+        response = self.client.get(
+            "/lego/compare/", query_params={"sets": "123 123-1"}
+        )
+
+        self.assertIn("Enter 2 to 10 different sets.", response.text)
+
+
 @test_settings
 class TestImageUrls(TestCase, OrderedPartsMixin):
     fixtures = ["test_data"]
@@ -323,6 +661,7 @@ class TestImageUrls(TestCase, OrderedPartsMixin):
 
 
 @test_settings
+@immediate_tasks
 class TestAddSet(TestCase, OrderedPartsMixin):
     fixtures = ["test_data", "test_user"]
 
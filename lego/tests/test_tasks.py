@@ -4,8 +4,10 @@ from django.core.management import call_command
 from django.test import TestCase
 
 from lego.images import store_part_image
+from lego.models import InventoryItem, LegoSet
+from lego.orm_utils import import_set
 
-from . import test_settings
+from . import test_settings, immediate_tasks, get_set_parts_mock, _API_DATA
 
 
 @test_settings
@@ -20,3 +22,67 @@ class TestTasks(TestCase):
         mock.assert_called_once()
         result.refresh()
         self.assertEqual(result.status, "SUCCESSFUL")
+
+
+@test_settings
+class TestImportSet(TestCase):
+    fixtures = ["test_data"]
+
+    def test_enqueue_and_run(self):
+        result = import_set.enqueue(
+            lego_id="2002-1", set_info=_API_DATA["2002-1"]["info"]
+        )
+        response = self.client.get(f"/lego/set/add/{result.id}/")
+        self.assertIn("Waiting in queue: 2002-1", response.text)
+
+        with get_set_parts_mock(), patch("lego.orm_utils.store_part_images"):
+            call_command("db_worker", max_tasks=1)
+
+        result.refresh()
+        self.assertEqual(result.status, "SUCCESSFUL")
+        self.assertTrue(LegoSet.objects.get(lego_id="2002-1").owned)
+
+        response = self.client.get(f"/lego/set/add/{result.id}/")
+        self.assertIn("Done:", response.text)
+        self.assertIn("/lego/set/2002-1/", response.text)
+
+    def test_unknown_result(self):
+        response = self.client.get(
+            "/lego/set/add/00000000-0000-0000-0000-000000000000/"
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_result_of_another_task(self):
+        result = store_part_image.enqueue(pk=1)
+
+        response = self.client.get(f"/lego/set/add/{result.id}/")
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_result_id(self):
+        response = self.client.get("/lego/set/add/not-a-uuid/")
+        self.assertEqual(response.status_code, 404)
+
+
+@test_settings
+@immediate_tasks
+class TestRefreshInventory(TestCase):
+    fixtures = ["test_data"]
+
+    def test_refreshed_after_import(self):
+        with get_set_parts_mock(), patch("lego.orm_utils.store_part_images"):
+            import_set.enqueue(
+                lego_id="2002-1", set_info=_API_DATA["2002-1"]["info"]
+            )
+
+        item = InventoryItem.objects.get(part=1)
+        self.assertEqual((item.quantity, item.num_sets), (12, 3))
+
+    def test_unowned_sets_not_counted(self):
+        LegoSet.objects.filter(lego_id="111-1").update(owned=False)
+        with get_set_parts_mock(), patch("lego.orm_utils.store_part_images"):
+            import_set.enqueue(
+                lego_id="2002-1", set_info=_API_DATA["2002-1"]["info"]
+            )
+
+        item = InventoryItem.objects.get(part=1)
+        self.assertEqual((item.quantity, item.num_sets), (11, 2))
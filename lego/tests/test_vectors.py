@@ -0,0 +1,163 @@
+from unittest.mock import patch
+
+import numpy as np
+from django.test import SimpleTestCase, TestCase
+
+from lego.models import LegoSet, SetItem
+from lego.orm_utils import refresh_inventory, stamp_items_revision
+from lego.vectors import (
+    Comparison,
+    Inventories,
+    collection_pool,
+    parts_list_pool,
+    rank_sets,
+    set_items,
+)
+
+from . import test_settings
+
+
+class TestInventories(SimpleTestCase):
+    def setUp(self):
+        # set 1: 2 x part 4 (in 2 items), 1 x part 7; set 3: 3 x part 4
+        self.inventories = Inventories(
+            np.array([3, 1, 1, 1]), np.array([4, 4, 7, 4]), np.array([3, 1, 1, 1])
+        )
+
+    def test_items_merged(self):
+        self.assertEqual(self.inventories.set_pks.tolist(), [1, 3])
+        self.assertEqual(self.inventories.indptr.tolist(), [0, 2, 3])
+        self.assertEqual(self.inventories.columns.tolist(), [4, 7, 4])
+        self.assertEqual(self.inventories.quantities.tolist(), [2, 1, 3])
+        self.assertEqual(self.inventories.totals().tolist(), [3, 3])
+
+    def test_buildability(self):
+        pool = np.array([0, 0, 0, 0, 2])    # 2 x part 4, part 7 out of the pool
+
+        scores = self.inventories.buildability(pool)
+
+        np.testing.assert_allclose(scores, [2 / 3, 2 / 3])
+
+    def test_empty(self):
+        inventories = Inventories(*np.zeros((3, 0), dtype=np.int64))
+
+        self.assertEqual(len(inventories), 0)
+        self.assertEqual(inventories.buildability(np.zeros(0)).tolist(), [])
+
+
+class TestComparison(SimpleTestCase):
+    def setUp(self):
+        # items (set, part, shape, quantity) of sets 5, 2 and 9
+        items = np.array([(2, 1, 1, 3), (5, 1, 1, 3), (9, 1, 1, 1), (9, 2, 1, 4)])
+        self.comparison = Comparison([5, 2, 9], items)
+
+    def test_matrix(self):
+        self.assertEqual(self.comparison.part_pks.tolist(), [1, 2])
+        self.assertEqual(self.comparison.matrix.tolist(), [[3, 0], [3, 0], [1, 4]])
+
+    def test_intersection(self):
+        self.assertEqual(self.comparison.intersection().tolist(), [1, 0])
+
+    def test_differences(self):
+        self.assertEqual(
+            self.comparison.differences().tolist(), [[0, 0], [0, 0], [0, 4]]
+        )
+
+    def test_jaccard(self):
+        np.testing.assert_allclose(
+            self.comparison.jaccard(),
+            [[1, 1, 1 / 7], [1, 1, 1 / 7], [1 / 7, 1 / 7, 1]],
+        )
+
+
+@test_settings
+class TestSetItems(TestCase):
+    fixtures = ["test_data"]
+
+    def setUp(self):
+        self.enterContext(patch("lego.vectors._cache", None))
+
+    def test_loaded_once(self):
+        items = set_items()
+
+        with self.assertNumQueries(1):    # number of sets and last revision
+            self.assertIs(set_items(), items)
+
+    @patch("lego.vectors.CHUNK_SIZE", 2)
+    def test_loaded_in_chunks(self):
+        items = set_items()
+
+        self.assertEqual(sorted(items.set_pks.tolist()), [1, 1, 1, 1, 2, 2, 2])
+        self.assertEqual(items.inventories().totals().tolist(), [5, 3])
+
+    def test_updated_sets_reloaded(self):
+        set_items()
+        SetItem.objects.filter(set=2).update(quantity=5)
+        stamp_items_revision(LegoSet.objects.filter(pk=2))
+
+        with self.assertNumQueries(3):    # + updated sets + their items
+            items = set_items()
+
+        self.assertEqual(items.inventories().totals().tolist(), [5, 15])
+
+    def test_new_set_loaded(self):
+        set_items()
+        new_set = LegoSet.objects.create(lego_id="3001-1")
+        SetItem.objects.create(set=new_set, part_id=3, quantity=2)
+
+        with self.assertNumQueries(3):    # not a full reload
+            items = set_items()
+
+        self.assertEqual(items.inventories().set_pks.tolist(), [1, 2, new_set.pk])
+
+    def test_deleted_set(self):
+        set_items()
+        LegoSet.objects.filter(pk=2).delete()
+
+        self.assertEqual(set_items().inventories().set_pks.tolist(), [1])
+
+
+@test_settings
+class TestRankSets(TestCase):
+    fixtures = ["test_data"]
+
+    def setUp(self):
+        self.enterContext(patch("lego.vectors._cache", None))
+
+    def test_collection(self):
+        refresh_inventory.call()
+
+        set_pks, scores = rank_sets(collection_pool(), pool_set_pks=[1, 2])
+
+        # each owned set is scored against the items of the other one
+        self.assertEqual(set_pks.tolist(), [2, 1])
+        np.testing.assert_allclose(scores, [1 / 3, 1 / 5])
+
+    def test_collection_without_unowned_sets(self):
+        LegoSet.objects.filter(pk=2).update(owned=False)
+        refresh_inventory.call()
+
+        set_pks, scores = rank_sets(collection_pool(), pool_set_pks=[1])
+
+        self.assertEqual(set_pks.tolist(), [2, 1])
+        np.testing.assert_allclose(scores, [1 / 3, 0])
+
+    def test_parts_list(self):
+        pool = parts_list_pool(
+            [("2345", "Red", 2), ("fig-0008", None, 1), ("9999", None, 1)]
+        )
+
+        set_pks, scores = rank_sets(pool)
+
+        self.assertEqual(set_pks.tolist(), [1, 2])
+        np.testing.assert_allclose(scores, [2 / 5, 1 / 3])
+
+    def test_color_agnostic(self):
+        pool = parts_list_pool(
+            [("2345", "Red", 2), ("fig-0008", None, 1)], color_agnostic=True
+        )
+
+        set_pks, scores = rank_sets(pool, color_agnostic=True)
+
+        self.assertEqual(set_pks.tolist(), [2, 1])
+        np.testing.assert_allclose(scores, [2 / 3, 2 / 5])
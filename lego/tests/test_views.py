@@ -28,6 +28,14 @@ class TestSearch(TestCase):
         self.assertIn("Brick 2 x 4", response.text)
 
 
+def _set_user(request, user):
+    async def auser():
+        return user
+
+    request.user = user
+    request.auser = auser
+
+
 @test_settings
 class TestAddSet(TestCase):
     fixtures = ["test_data", "test_user"]
@@ -35,41 +43,41 @@ class TestAddSet(TestCase):
     def setUp(self):
         self.factory = RequestFactory()
 
-    def test_get_request(self):
+    async def test_get_request(self):
         request = self.factory.get("/lego/set/add/")
-        request.user = User.objects.get()
+        _set_user(request, await User.objects.aget())
 
-        response = add_set(request)
+        response = await add_set(request)
 
         self.assertEqual(response.status_code, 200)
         self.assertIn("Lego Set ID:", response.text)
 
-    def test_get_request_anonymous_user(self):
+    async def test_get_request_anonymous_user(self):
         request = self.factory.get("/lego/set/add/")
-        request.user = AnonymousUser()
+        _set_user(request, AnonymousUser())
 
-        response = add_set(request)
+        response = await add_set(request)
 
         # redirect to login
         self.assertEqual(response.status_code, 302)
         self.assertIn("/login", response.url)
 
-    def test_post_request(self):
+    async def test_post_request(self):
         request = self.factory.post("/lego/set/add/", data={"set_lego_id": "123-1"})
-        request.user = User.objects.get()
+        _set_user(request, await User.objects.aget())
 
         with patch.object(request, "_messages", create=True):
-            response = add_set(request)
+            response = await add_set(request)
 
         # redirect to itself
         self.assertEqual(response.status_code, 302)
         self.assertIn("/set/add", response.url)
 
-    def test_post_request_anonymous_user(self):
+    async def test_post_request_anonymous_user(self):
         request = self.factory.post("/lego/set/add/", data={"set_lego_id": "123-1"})
-        request.user = AnonymousUser()
+        _set_user(request, AnonymousUser())
 
-        response = add_set(request)
+        response = await add_set(request)
 
         # redirect to login
         self.assertEqual(response.status_code, 302)
@@ -1,14 +1,36 @@
 from django.urls import path
 
-from .views import IndexView, SetDetail, PartDetail, search, add_set, login, logout
+from .views import (
+    IndexView,
+    SetDetail,
+    PartDetail,
+    search,
+    autocomplete,
+    inventory,
+    inventory_json,
+    buildable,
+    compare,
+    compare_json,
+    add_set,
+    import_status,
+    login,
+    logout,
+)
 
 urlpatterns = [
     path("", IndexView.as_view(), name="index"),
     path("set/add/", add_set, name="add_set"),
+    path("set/add/<result_id>/", import_status, name="import_status"),
     path("set/<lego_id>/", SetDetail.as_view(), name="set_detail"),
     path("part/<lego_id>/", PartDetail.as_view(), name="part_detail"),
     path("part/<lego_id>/<int:color_id>/", PartDetail.as_view(), name="part_detail"),
     path("search/", search, name="search"),
+    path("search/autocomplete/", autocomplete, name="autocomplete"),
+    path("inventory/", inventory, name="inventory"),
+    path("inventory/json/", inventory_json, name="inventory_json"),
+    path("buildable/", buildable, name="buildable"),
+    path("compare/", compare, name="compare"),
+    path("compare/json/", compare_json, name="compare_json"),
     path("login/", login, name="login"),
     path("logout/", logout, name="logout"),
 ]
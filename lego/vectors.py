@@ -0,0 +1,259 @@
+"""Set inventories as arrays indexed by part, to score all sets against
+a pool of owned parts or to compare sets, without a query per set.
+
+Items of all sets are loaded once and kept in memory. Afterwards, only the
+items of new sets and of the sets whose items changed since, according to
+`LegoSet.items_revision`, are loaded again. Every writer of set items bumps
+that revision, in order of commit.
+"""
+import threading
+
+import numpy as np
+from django.db.models import Count, Max, Q
+from django.db.models.functions import Coalesce
+
+from .models import InventoryItem, LegoPart, LegoSet, SetItem
+
+ITEM_FIELDS = ("set_id", "part_id", "part__shape_id", "quantity")
+CHUNK_SIZE = 10000  # rows fetched at a time when loading set items
+
+_lock = threading.Lock()
+_cache = None  # `SetItems` of all sets, see `set_items()`
+
+
+def _to_array(rows, num_fields):
+    return np.array(list(rows), dtype=np.int64).reshape(-1, num_fields)
+
+
+def _stream_array(queryset, num_fields):
+    """Return the integer rows of a `values_list()` queryset as an array,
+    filled while the rows are fetched in chunks instead of listed first.
+    """
+    rows = queryset.iterator(chunk_size=CHUNK_SIZE)
+    if num_fields == 1:
+        return np.fromiter(rows, dtype=np.int64)
+    return np.fromiter(rows, dtype=np.dtype((np.int64, num_fields)))
+
+
+class Inventories:
+    """Item quantities of several sets, as a sparse matrix in CSR layout:
+    the items of set `set_pks[i]` are `columns[indptr[i]:indptr[i + 1]]`,
+    with their `quantities` at the same positions. Columns are part pks,
+    or shape pks when colors are ignored, sorted within each set.
+    """
+
+    def __init__(self, set_pks, columns, quantities):
+        """Build the matrix from one value per item, merging the items
+        of the same set and column.
+        """
+        num_columns = int(columns.max(initial=0)) + 1
+        keys, inverse = np.unique(
+            set_pks * num_columns + columns, return_inverse=True
+        )
+        self.columns = keys % num_columns
+        self.quantities = np.bincount(
+            inverse, weights=quantities, minlength=len(keys)
+        ).astype(np.int64)
+        self.set_pks, starts = np.unique(keys // num_columns, return_index=True)
+        self.indptr = np.append(starts, len(keys))
+
+    def __len__(self):
+        return len(self.set_pks)
+
+    def sum_rows(self, values):
+        """Sum `values`, given for each item, over the items of each set."""
+        sums = np.concatenate(([0], np.cumsum(values)))
+        return sums[self.indptr[1:]] - sums[self.indptr[:-1]]
+
+    def totals(self):
+        """Return the number of pieces of each set."""
+        return self.sum_rows(self.quantities)
+
+    def buildability(self, pool, in_pool=None):
+        """Return the fraction of the pieces of each set found in `pool`,
+        an array of owned quantities indexed by column. The sets flagged in
+        `in_pool`, whose items are part of `pool`, are scored against the
+        rest of it.
+        """
+        owned = np.zeros(len(self.columns), dtype=np.int64)
+        known = self.columns < len(pool)
+        owned[known] = pool[self.columns[known]]
+        if in_pool is not None:
+            owned -= np.repeat(in_pool, np.diff(self.indptr)) * self.quantities
+            np.maximum(owned, 0, out=owned)
+        totals = self.totals()
+        covered = self.sum_rows(np.minimum(self.quantities, owned))
+        return np.divide(
+            covered, totals, out=np.zeros(len(totals)), where=totals > 0
+        )
+
+
+class Comparison:
+    """Item quantities of a few sets as a dense matrix: row `i` holds the
+    quantities of set `set_pks[i]`, columns are the parts in `part_pks`.
+    """
+
+    def __init__(self, set_pks, items):
+        self.set_pks = np.asarray(set_pks, dtype=np.int64)
+        item_set_pks, part_ids, _, quantities = items.T
+        self.part_pks, columns = np.unique(part_ids, return_inverse=True)
+        order = np.argsort(self.set_pks)
+        rows = order[np.searchsorted(self.set_pks, item_set_pks, sorter=order)]
+        self.matrix = np.zeros((len(self.set_pks), len(self.part_pks)), dtype=np.int64)
+        np.add.at(self.matrix, (rows, columns), quantities)
+
+    def intersection(self):
+        """Return the quantities of each part found in all sets."""
+        return self.matrix.min(axis=0)
+
+    def differences(self):
+        """Return, for each set, the quantities of each part it has more of
+        than any other set.
+        """
+        ordered = np.sort(self.matrix, axis=0)
+        largest, second = ordered[-1], ordered[-2]
+        others = np.where(self.matrix == largest, second, largest)
+        return np.maximum(self.matrix - others, 0)
+
+    def jaccard(self):
+        """Return the matrix of the Jaccard similarity of each pair of sets,
+        counting each piece of their inventories.
+        """
+        pairs = (self.matrix[:, np.newaxis, :], self.matrix[np.newaxis, :, :])
+        shared = np.minimum(*pairs).sum(axis=2)
+        total = np.maximum(*pairs).sum(axis=2)
+        return np.divide(
+            shared, total, out=np.zeros(shared.shape), where=total > 0
+        )
+
+
+class SetItems:
+    """Items of all sets, one value per `SetItem` in each array."""
+
+    def __init__(self, items, all_set_pks, revision):
+        self.set_pks, self.part_ids, self.shape_ids, self.quantities = items.T
+        self.all_set_pks = all_set_pks  # including sets without items
+        self.revision = revision
+        self._inventories = {}
+
+    @classmethod
+    def load(cls):
+        sets = _stream_array(LegoSet.objects.values_list("pk", "items_revision"), 2)
+        items = _stream_array(SetItem.objects.values_list(*ITEM_FIELDS), 4)
+        return cls(items, sets[:, 0], int(sets[:, 1].max(initial=0)))
+
+    def reload_updated(self, num_sets, revision):
+        """Return the items with those of the new sets and of the sets with
+        changed items replaced, or None if there should be another number of
+        sets.
+        """
+        updated = LegoSet.objects.filter(
+            Q(items_revision__gt=self.revision)
+            | Q(pk__gt=self.all_set_pks.max(initial=0))
+        )
+        updated_set_pks = _stream_array(updated.values_list("pk", flat=True), 1)
+        all_set_pks = np.union1d(self.all_set_pks, updated_set_pks)
+        if len(all_set_pks) != num_sets:
+            return None  # sets were deleted
+
+        new_items = _stream_array(
+            SetItem.objects.filter(set__in=updated_set_pks.tolist())
+            .values_list(*ITEM_FIELDS),
+            4,
+        )
+        items = np.column_stack(
+            (self.set_pks, self.part_ids, self.shape_ids, self.quantities)
+        )
+        kept = ~np.isin(self.set_pks, updated_set_pks)
+        return SetItems(
+            np.concatenate((items[kept], new_items)), all_set_pks, revision
+        )
+
+    def inventories(self, color_agnostic=False):
+        if color_agnostic not in self._inventories:
+            columns = self.shape_ids if color_agnostic else self.part_ids
+            self._inventories[color_agnostic] = Inventories(
+                self.set_pks, columns, self.quantities
+            )
+        return self._inventories[color_agnostic]
+
+
+def set_items():
+    """Return the items of all sets, loading only what changed since the
+    previous call.
+    """
+    global _cache
+    with _lock:
+        state = LegoSet.objects.aggregate(
+            num_sets=Count("pk"), revision=Coalesce(Max("items_revision"), 0)
+        )
+        if _cache is None:
+            _cache = SetItems.load()
+        elif (state["num_sets"], state["revision"]) != (
+            len(_cache.all_set_pks), _cache.revision
+        ):
+            _cache = _cache.reload_updated(**state) or SetItems.load()
+        return _cache
+
+
+def collection_pool(color_agnostic=False):
+    """Return the owned quantities of all parts in the owned sets, indexed
+    by part pk, or by shape pk if `color_agnostic`.
+    """
+    column = "part__shape_id" if color_agnostic else "part_id"
+    rows = _stream_array(InventoryItem.objects.values_list(column, "quantity"), 2)
+    return np.bincount(rows[:, 0], weights=rows[:, 1]).astype(np.int64)
+
+
+def owned_set_pks():
+    """Return the pks of the owned sets, whose items make `collection_pool()`."""
+    return _stream_array(
+        LegoSet.objects.filter(owned=True).values_list("pk", flat=True), 1
+    )
+
+
+def parts_list_pool(rows, color_agnostic=False):
+    """Return the owned quantities of the parts listed in `rows`, tuples
+    `(lego_id, color_name, quantity)`, indexed like `collection_pool()`.
+    The color name is ignored if `color_agnostic`. Unknown parts are skipped.
+    """
+    parts = LegoPart.objects.filter(
+        shape__lego_id__in={lego_id for lego_id, _, _ in rows}
+    ).values_list("pk", "shape_id", "shape__lego_id", "color__name")
+    columns = {}
+    for pk, shape_pk, lego_id, color_name in parts:
+        if color_agnostic:
+            columns[lego_id] = shape_pk
+        else:
+            columns[lego_id, color_name] = pk
+
+    owned = []
+    for lego_id, color_name, quantity in rows:
+        key = lego_id if color_agnostic else (lego_id, color_name)
+        if key in columns:
+            owned.append((columns[key], quantity))
+    owned = _to_array(owned, 2)
+    return np.bincount(owned[:, 0], weights=owned[:, 1]).astype(np.int64)
+
+
+def rank_sets(pool, color_agnostic=False, pool_set_pks=None):
+    """Return the pks of the sets with items and their buildability with
+    the parts of `pool`, the most buildable sets first. The sets with
+    `pool_set_pks`, whose items make `pool`, are scored without their own
+    items.
+    """
+    inventories = set_items().inventories(color_agnostic)
+    in_pool = None
+    if pool_set_pks is not None:
+        in_pool = np.isin(inventories.set_pks, pool_set_pks)
+    scores = inventories.buildability(pool, in_pool)
+    order = np.argsort(-scores, kind="stable")
+    return inventories.set_pks[order], scores[order]
+
+
+def compare_sets(set_pks):
+    """Return the `Comparison` of the sets with `set_pks`, whose items are
+    loaded in one query.
+    """
+    items = SetItem.objects.filter(set__in=set_pks).values_list(*ITEM_FIELDS)
+    return Comparison(set_pks, _stream_array(items, 4))
@@ -1,42 +1,126 @@
 import logging
 
+from asgiref.sync import sync_to_async
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.views import LoginView, LogoutView
-from django.db.models import Q
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db.models import Q, Value
+from django.db.models.functions import Greatest, Upper
+from django.http import Http404, JsonResponse
 from django.shortcuts import get_object_or_404, render, redirect
+from django.tasks.exceptions import TaskResultDoesNotExist, TaskResultMismatch
+from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.utils.html import format_html
+from django.views.decorators.http import condition
 from django.views.generic import DetailView, ListView
+from django_tasks import exceptions as db_task_exceptions
+
+from .api_calls import aget_set_info
+from .caching import FRAGMENT_TIMEOUT, get_version, with_catalog_revision
+from .forms import (
+    SearchForm,
+    AddSetForm,
+    InventoryForm,
+    BuildableForm,
+    CompareForm,
+)
+from .models import InventoryItem, LegoPart, LegoSet, Shape, WordDistance
+from .orm_utils import import_set
+from .pagination import BoundedPage, KeysetPage
+from .vectors import (
+    collection_pool,
+    compare_sets,
+    owned_set_pks,
+    parts_list_pool,
+    rank_sets,
+)
 
-from .api_calls import get_set_info
-from .forms import SearchForm, AddSetForm
-from .models import LegoPart, LegoSet
-from .orm_utils import get_set, save_set_with_parts
+SEARCH_PAGE_SIZE = 24
+MAX_SEARCH_RESULTS = 1000
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MIN_LENGTH = 3
+INVENTORY_PAGE_SIZE = 48
+MAX_INVENTORY_ROWS = 10000
+INVENTORY_ORDERINGS = {
+    "quantity": ("-quantity", "part_id"),
+    "sets": ("-num_sets", "part_id"),
+    "part": ("part__shape__lego_id", "part__color__name", "part_id"),
+}
+BUILDABLE_PAGE_SIZE = 24
 
 logger = logging.getLogger(__name__)
 
 
 class IndexView(ListView):
+    """Latest sets, paginated by the pk of the last set shown (`?after=`).
+    With `?partial=1`, only the set tiles are rendered, for infinite scroll.
+    """
     template_name = "lego/index.html"
-    paginate_by = 24
+    page_size = 24
     extra_context = {"title": "Home"}
 
     def get_queryset(self):
-        return LegoSet.objects.select_related("image").order_by("-pk")
+        return LegoSet.objects.select_related("image")
+
+    def get_template_names(self):
+        if self.request.GET.get("partial"):
+            return [f"{self.template_name}#set_tiles"]
+        return [self.template_name]
+
+    def get_context_data(self, **kwargs):
+        try:
+            after = int(self.request.GET["after"])
+        except KeyError:
+            after = None
+        except ValueError:
+            raise Http404("Invalid value of after")
+
+        page = KeysetPage(self.object_list, after, self.page_size)
+        return super().get_context_data(object_list=page, page=page, **kwargs)
+
+
+def _conditional(get_queryset):
+    """Answer conditional GET requests of the object of `get_queryset(**kwargs)`
+    with one query of its `updated_at` and of the catalog revision. ETags
+    differ by user, who is shown in the page header.
+    """
+    def versions(request, **kwargs):
+        if not hasattr(request, "_versions"):
+            request._versions = (
+                with_catalog_revision(get_queryset(**kwargs))
+                .values_list("updated_at", "catalog_revision", "catalog_updated_at")
+                .first()
+            )
+        return request._versions
+
+    def last_modified(request, **kwargs):
+        if (found := versions(request, **kwargs)) is None:
+            return None
+        updated_at, _, catalog_updated_at = found
+        return max(updated_at, catalog_updated_at or updated_at)
+
+    def etag(request, **kwargs):
+        if (found := versions(request, **kwargs)) is None:
+            return None
+        updated_at, catalog_revision, _ = found
+        return f"{catalog_revision}-{updated_at.timestamp()}-{request.user.pk}"
+
+    return method_decorator(
+        condition(etag_func=etag, last_modified_func=last_modified), name="get"
+    )
 
 
+@_conditional(lambda lego_id: LegoSet.objects.filter(lego_id=lego_id))
 class SetDetail(DetailView):
+    """Set page. Its content is cached, so the set items are only queried
+    when the cached content is missing or outdated.
+    """
     template_name = "lego/set_detail.html"
 
     def get_queryset(self):
-        return (
-            LegoSet.objects
-            .select_related("image")
-            .prefetch_related(
-                "setitem_set__part__shape",
-                "setitem_set__part__color",
-                "setitem_set__part__image",
-            )
-        )
+        return with_catalog_revision(LegoSet.objects.select_related("image"))
 
     def get_object(self, queryset=None):
         return get_object_or_404(
@@ -46,17 +130,30 @@ class SetDetail(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        return context | {"title": f"Lego Set {self.object}"}
-
-
+        return context | {
+            "title": f"Lego Set {self.object}",
+            "items": self.object.setitem_set.select_related(
+                "part__shape", "part__color", "part__image"
+            ),
+            "cache_version": get_version(self.object),
+            "cache_timeout": FRAGMENT_TIMEOUT,
+        }
+
+
+@_conditional(
+    lambda lego_id, color_id=None: LegoPart.objects.filter(
+        shape__lego_id=lego_id, color=color_id
+    )
+)
 class PartDetail(DetailView):
+    """Part page. Its content is cached, so the set items are only queried
+    when the cached content is missing or outdated.
+    """
     template_name = "lego/part_detail.html"
 
     def get_queryset(self):
-        return (
-            LegoPart.objects
-            .select_related("shape", "color", "image")
-            .prefetch_related("setitem_set__set__image")
+        return with_catalog_revision(
+            LegoPart.objects.select_related("shape", "color", "image")
         )
 
     def get_object(self, queryset=None):
@@ -68,7 +165,42 @@ class PartDetail(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        return context | {"title": f"Lego Part {self.object}"}
+        return context | {
+            "title": f"Lego Part {self.object}",
+            "items": self.object.setitem_set.select_related("set__image"),
+            "cache_version": get_version(self.object),
+            "cache_timeout": FRAGMENT_TIMEOUT,
+        }
+
+
+def _by_relevance(queryset, q, search_string, *fields):
+    """Return the objects of `queryset` matching `q`, ordered by the best
+    trigram word similarity of `search_string` to any of `fields`.
+
+    At most `MAX_SEARCH_RESULTS` matches per field are scored: those nearest
+    to `search_string` in that field, which the GiST trigram indexes return in
+    distance order. Their union holds the best `MAX_SEARCH_RESULTS` matches,
+    as each of these is among the nearest in its most similar field.
+    """
+    matches = queryset.filter(q).values("pk")
+    candidates = Q()
+    for field in fields:
+        distance = WordDistance(Upper(field), Value(search_string))
+        candidates |= Q(pk__in=matches.order_by(distance)[:MAX_SEARCH_RESULTS])
+    similarities = [TrigramWordSimilarity(search_string, field) for field in fields]
+    relevance = Greatest(*similarities) if len(similarities) > 1 else similarities[0]
+    return (
+        queryset.filter(candidates)
+        .annotate(relevance=relevance)
+        .order_by("-relevance", "pk")
+    )
+
+
+def _page_number(request, name):
+    try:
+        return max(int(request.GET.get(name, 1)), 1)
+    except ValueError:
+        return 1
 
 
 def search(request):
@@ -89,69 +221,309 @@ def search(request):
     shape_num_code_q = Q(shape__num_code__exact=search_string)
     color_name_q = Q(color__name__icontains=search_string)
 
+    sets = LegoSet.objects.select_related("image")
+    parts = LegoPart.objects.select_related("shape", "color", "image")
     if search_mode == "name":
-        sets = LegoSet.objects.select_related("image").filter(name_q)
-        parts = LegoPart.objects.select_related(
-            "shape", "color", "image"
-        ).filter(shape_name_q)
+        sets = _by_relevance(sets, name_q, search_string, "name")
+        parts = _by_relevance(parts, shape_name_q, search_string, "shape__name")
     elif search_mode == "id":
-        sets = LegoSet.objects.select_related("image").filter(lego_id_q)
-        parts = LegoPart.objects.select_related(
-            "shape", "color", "image"
-        ).filter(shape_num_code_q)
+        sets = _by_relevance(sets, lego_id_q, search_string, "lego_id")
+        parts = _by_relevance(
+            parts, shape_num_code_q, search_string, "shape__lego_id"
+        )
     elif search_mode == "color":
         sets = LegoSet.objects.none()  # sets don't have colors
-        parts = LegoPart.objects.select_related(
-            "shape", "color", "image"
-        ).filter(color_name_q)
+        parts = _by_relevance(parts, color_name_q, search_string, "color__name")
     else:
-        sets = LegoSet.objects.select_related("image").filter(name_q | lego_id_q)
-        parts = LegoPart.objects.select_related(
-            "shape", "color", "image"
-        ).filter(shape_name_q | shape_num_code_q | color_name_q)
+        sets = _by_relevance(sets, name_q | lego_id_q, search_string, "name", "lego_id")
+        parts = _by_relevance(
+            parts,
+            shape_name_q | shape_num_code_q | color_name_q,
+            search_string,
+            "shape__name",
+            "shape__lego_id",
+            "color__name",
+        )
 
     return render(
         request,
         "lego/search.html",
         context={
-            "sets": sets,
-            "parts": parts,
+            "sets": BoundedPage(
+                sets,
+                _page_number(request, "sets_page"),
+                SEARCH_PAGE_SIZE,
+                MAX_SEARCH_RESULTS,
+            ),
+            "parts": BoundedPage(
+                parts,
+                _page_number(request, "parts_page"),
+                SEARCH_PAGE_SIZE,
+                MAX_SEARCH_RESULTS,
+            ),
             "title": f"Search Results for {search_string!r}",
             "search_form": form,
         },
     )
 
 
+def autocomplete(request):
+    """Return the first sets and parts whose Lego ID or name starts with
+    the `q` parameter, of at least `AUTOCOMPLETE_MIN_LENGTH` characters, as
+    JSON. Both prefix lookups use indexes. The Lego ID prefix also covers
+    `Shape.num_code`, which is a prefix of the Lego ID.
+    """
+    prefix = request.GET.get("q", "").strip()[:150]
+    if len(prefix) < AUTOCOMPLETE_MIN_LENGTH:
+        return JsonResponse({"sets": [], "parts": []})
+
+    sets = (
+        LegoSet.objects
+        .filter(Q(lego_id__startswith=prefix) | Q(name__istartswith=prefix))
+        .only("lego_id", "name")
+        .order_by("lego_id")[:AUTOCOMPLETE_LIMIT]
+    )
+    # the first parts are those of the first shapes, found without joins
+    shapes = (
+        Shape.objects
+        .filter(Q(lego_id__startswith=prefix) | Q(name__istartswith=prefix))
+        .order_by("lego_id")
+        .values("pk")[:AUTOCOMPLETE_LIMIT]
+    )
+    parts = (
+        LegoPart.objects
+        .select_related("shape", "color")
+        .filter(shape__in=shapes)
+        .only("shape__lego_id", "shape__name", "color__name")
+        .order_by("shape__lego_id", "color__name")[:AUTOCOMPLETE_LIMIT]
+    )
+    return JsonResponse(
+        {
+            "sets": [
+                {
+                    "lego_id": set_.lego_id,
+                    "name": set_.name,
+                    "url": set_.get_absolute_url(),
+                }
+                for set_ in sets
+            ],
+            "parts": [
+                {
+                    "lego_id": part.shape.lego_id,
+                    "name": part.shape.name,
+                    "color": part.color and part.color.name,
+                    "url": part.get_absolute_url(),
+                }
+                for part in parts
+            ],
+        }
+    )
+
+
+def _inventory_page(request, form):
+    items = InventoryItem.objects.select_related(
+        "part__shape", "part__color", "part__image"
+    )
+    if color := form.cleaned_data["color"]:
+        items = items.filter(part__color=color)
+    ordering = INVENTORY_ORDERINGS[form.cleaned_data["sort"] or "quantity"]
+    return BoundedPage(
+        items.order_by(*ordering),
+        _page_number(request, "page"),
+        INVENTORY_PAGE_SIZE,
+        MAX_INVENTORY_ROWS,
+    )
+
+
+def inventory(request):
+    """Quantities of all parts owned, summed over all sets."""
+    form = InventoryForm(request.GET)
+    context = {"title": "Inventory", "inventory_form": form}
+    if form.is_valid():
+        context["items"] = _inventory_page(request, form)
+    return render(request, "lego/inventory.html", context=context)
+
+
+def _part_data(part):
+    return {
+        "lego_id": part.shape.lego_id,
+        "name": part.shape.name,
+        "color": part.color and part.color.name,
+        "url": part.get_absolute_url(),
+    }
+
+
+def inventory_json(request):
+    """Return a page of the inventory as JSON, with the same parameters
+    as the inventory page.
+    """
+    form = InventoryForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({"errors": form.errors.get_json_data()}, status=400)
+
+    items = _inventory_page(request, form)
+    return JsonResponse(
+        {
+            "items": [
+                {
+                    **_part_data(item.part),
+                    "quantity": item.quantity,
+                    "num_sets": item.num_sets,
+                }
+                for item in items
+            ],
+            "page": items.number,
+            "has_next": items.has_next(),
+        }
+    )
+
+
+def buildable(request):
+    """All sets with parts, ranked by the fraction of their pieces found
+    in the collection, or in a parts list uploaded with POST. Owned sets
+    are ranked by the fraction found in the rest of the collection.
+    """
+    if request.method == "POST":
+        form = BuildableForm(request.POST, request.FILES)
+    else:
+        form = BuildableForm(request.GET)
+    context = {"title": "What Can I Build", "buildable_form": form}
+    if not form.is_valid():
+        return render(request, "lego/buildable.html", context=context)
+
+    color_agnostic = form.cleaned_data["color_agnostic"]
+    if (parts_list := form.cleaned_data["parts_list"]) is not None:
+        pool = parts_list_pool(parts_list, color_agnostic)
+        pool_set_pks = None
+    else:
+        pool = collection_pool(color_agnostic)
+        pool_set_pks = owned_set_pks()
+    set_pks, scores = rank_sets(pool, color_agnostic, pool_set_pks)
+
+    page = BoundedPage(
+        list(zip(set_pks.tolist(), scores.tolist())),
+        _page_number(request, "page"),
+        BUILDABLE_PAGE_SIZE,
+        len(set_pks),
+    )
+    sets = LegoSet.objects.select_related("image").in_bulk([pk for pk, _ in page])
+    context |= {
+        "page": page,
+        "results": [(sets[pk], score * 100) for pk, score in page if pk in sets],
+        "paginated": request.method == "GET",
+    }
+    return render(request, "lego/buildable.html", context=context)
+
+
+def _compare(form):
+    """Compare the sets of a valid `CompareForm`. Return None and add
+    an error to the form if some sets are not found.
+    """
+    lego_ids = form.cleaned_data["sets"]
+    sets = LegoSet.objects.select_related("image").in_bulk(
+        lego_ids, field_name="lego_id"
+    )
+    if unknown := [lego_id for lego_id in lego_ids if lego_id not in sets]:
+        form.add_error("sets", f"Sets not found: {', '.join(unknown)}")
+        return None
+
+    sets = [sets[lego_id] for lego_id in lego_ids]
+    comparison = compare_sets([set_.pk for set_ in sets])
+    part_pks = comparison.part_pks.tolist()
+    parts = LegoPart.objects.select_related("shape", "color", "image").in_bulk(
+        part_pks
+    )
+
+    def items(quantities):
+        return sorted(
+            (
+                (parts[pk], quantity)
+                for pk, quantity in zip(part_pks, quantities.tolist())
+                if quantity
+            ),
+            key=lambda item: str(item[0]),
+        )
+
+    return {
+        "sets": sets,
+        "intersection": items(comparison.intersection()),
+        "differences": list(zip(sets, map(items, comparison.differences()))),
+        "similarities": list(zip(sets, comparison.jaccard().tolist())),
+    }
+
+
+def compare(request):
+    """Parts shared by the sets given with `?sets=`, parts found only in
+    one of them and the similarity of each pair of sets.
+    """
+    form = CompareForm(request.GET or None)
+    context = {"title": "Compare Sets", "compare_form": form}
+    if form.is_valid() and (comparison := _compare(form)) is not None:
+        context |= comparison
+    return render(request, "lego/compare.html", context=context)
+
+
+def compare_json(request):
+    """Return the comparison of the sets given with `?sets=` as JSON."""
+    form = CompareForm(request.GET)
+    if not form.is_valid() or (comparison := _compare(form)) is None:
+        return JsonResponse({"errors": form.errors.get_json_data()}, status=400)
+
+    def items(part_quantities):
+        return [
+            {**_part_data(part), "quantity": quantity}
+            for part, quantity in part_quantities
+        ]
+
+    return JsonResponse(
+        {
+            "sets": [
+                {
+                    "lego_id": set_.lego_id,
+                    "name": set_.name,
+                    "url": set_.get_absolute_url(),
+                }
+                for set_ in comparison["sets"]
+            ],
+            "intersection": items(comparison["intersection"]),
+            "differences": {
+                set_.lego_id: items(part_quantities)
+                for set_, part_quantities in comparison["differences"]
+            },
+            "jaccard": [row for _, row in comparison["similarities"]],
+        }
+    )
+
+
+def _render_add_set(request, form):
+    return render(
+        request,
+        "lego/add_set.html",
+        context={
+            "add_set_form": form,
+            "title": "Add a New Lego Set",
+        },
+    )
+
+
 @login_required(login_url="/lego/login")
-def add_set(request):
+async def add_set(request):
+    """Add a new set. The set info is fetched asynchronously, the import
+    itself runs as a background task.
+    """
     if request.method == "GET":
-        return render(
-            request,
-            "lego/add_set.html",
-            context={
-                "add_set_form": AddSetForm,
-                "title": "Add a New Lego Set",
-            },
-        )
+        return await sync_to_async(_render_add_set)(request, AddSetForm)
 
     form = AddSetForm(request.POST)
     if not form.is_valid():
-        return render(
-            request,
-            "lego/add_set.html",
-            context={
-                "add_set_form": form,
-                "title": "Add a New Lego Set",
-            },
-        )
+        return await sync_to_async(_render_add_set)(request, form)
 
     set_lego_id = form.cleaned_data["set_lego_id"]
     if "-" not in set_lego_id:
         set_lego_id += "-1"
 
-    q = LegoSet.objects.filter(lego_id=set_lego_id)
-    if q:
-        set_ = q.get()
+    set_ = await LegoSet.objects.filter(lego_id=set_lego_id).afirst()
+    if set_ is not None:
         logger.warning(f"Already exists: {set_!r}")
         messages.warning(
             request, f"Already exists: {set_}", extra_tags="is-warning"
@@ -159,7 +531,7 @@ def add_set(request):
         return redirect("add_set")
 
     try:
-        set_info = get_set_info(set_lego_id)
+        set_info = await aget_set_info(set_lego_id)
     except OSError as err:
         logger.error(f"Error calling external API: {err}")
         messages.error(
@@ -167,14 +539,44 @@ def add_set(request):
         )
         return redirect("add_set")
 
-    set_, _ = get_set(set_lego_id)
-    save_set_with_parts(set_, set_info)
+    result = await import_set.aenqueue(lego_id=set_lego_id, set_info=set_info)
     messages.success(
-        request, f"Added to queue: {set_}", extra_tags="is-success"
+        request,
+        format_html(
+            'Added to queue: {} {} (<a href="{}">status</a>)',
+            set_lego_id,
+            set_info["name"],
+            reverse("import_status", kwargs={"result_id": result.id}),
+        ),
+        extra_tags="is-success",
     )
     return redirect("add_set")
 
 
+def import_status(request, result_id):
+    try:
+        result = import_set.get_result(result_id)
+    except (
+        TaskResultDoesNotExist,
+        TaskResultMismatch,    # result of another task
+        # raised by django-tasks-db, which is built on the django-tasks backport
+        db_task_exceptions.TaskResultDoesNotExist,
+        db_task_exceptions.TaskResultMismatch,
+    ):
+        raise Http404("Unknown import")
+
+    lego_id = result.kwargs["lego_id"]
+    return render(
+        request,
+        "lego/import_status.html",
+        context={
+            "result": result,
+            "lego_id": lego_id,
+            "title": f"Import of Lego Set {lego_id}",
+        },
+    )
+
+
 _login = LoginView.as_view(
     template_name="lego/login.html",
     next_page="/lego/",
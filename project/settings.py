@@ -25,6 +25,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "lego.apps.LegoConfig",
     "django_tasks_db",
     "debug_toolbar",
@@ -75,6 +76,20 @@ DATABASES = {
     ),
 }
 
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv(
+            "LEGO_CACHE_BACKEND",
+            "django.core.cache.backends.filebased.FileBasedCache",
+        ),
+        # shared by the web and task worker processes, outside the source tree
+        "LOCATION": os.getenv(
+            "LEGO_CACHE_LOCATION",
+            Path(os.getenv("XDG_CACHE_HOME", Path.home() / ".cache")) / "lego",
+        ),
+    },
+}
+
 
 # Password validation
 